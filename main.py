@@ -1,10 +1,12 @@
 import sys
 import json
 import os
-from modules import diagnostic, backup, audit
+from modules import diagnostic, backup, audit, history, config
 from modules.utils import *
 
 def main_menu():
+    config.setup_metrics()
+
     while True: 
         clear_screen()
 
@@ -14,6 +16,7 @@ def main_menu():
         print("1. Module Diagnostic (Santé Réseau)")
         print("2. Module Sauvegarde (WMS & NAS)")
         print("3. Module Audit (Obsolescence)")
+        print("4. Module Historique (Requêtes)")
         print("q. Quitter")
 
         choice = input("Votre choix: ")
@@ -30,6 +33,9 @@ def main_menu():
             print("Lancement de l'audit...")
             audit.scan_menu()
 
+        elif choice == '4':
+            history.history_menu()
+
         elif choice == 'q':
             print("Fermeture")
             sys.exit(0)
@@ -1,19 +1,23 @@
 import socket
-import json
 import os
 import csv
-import ipaddress
 import platform
 import subprocess
 import requests
 import concurrent.futures
 from datetime import datetime
 from .utils import *
+from . import metrics, config
+from .targets import iter_targets, stream_map, ip_to_int
+from array import array
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE = os.path.join(BASE_DIR, "configs", "audit.json")
 LOGS_DIR = os.path.join(os.path.dirname(BASE_DIR), "logs")
 
+MAX_WORKERS = 127
+# nb max de scans en attente -> mémoire stable même sur un /16
+MAX_IN_FLIGHT = MAX_WORKERS * 4
+
 # mapping API endoflife.date
 API_MAPPING = {
     "Windows Server 2016": ("windows-server", "2016"),
@@ -36,22 +40,12 @@ KNOWN_HOSTS = {
     "192.168.10.254": "pfSense 2.7.2"
 }
 
-def load_config():
-    if not os.path.exists(CONFIG_FILE):
-        print(f"[ERREUR] Config introuvable : {CONFIG_FILE}")
-        return None
-    try:
-        with open(CONFIG_FILE, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"[ERREUR] Lecture JSON : {e}")
-        return None
-
-def fetch_eol_date_from_api(product, version):
+@metrics.timed("audit.eol_api")
+def fetch_eol_date_from_api(product, version, timeout=2):
     url = f"https://endoflife.date/api/v1/products/{product}"
 
     try:
-        response = requests.get(url, timeout=2)
+        response = requests.get(url, timeout=timeout)
         if response.status_code == 200:
             data = response.json()
 
@@ -84,6 +78,7 @@ def fetch_eol_date_from_api(product, version):
         return None
     return "Erreur API", "N/A"
 
+@metrics.timed("audit.get_eol_status")
 def get_eol_status(os_name):
     """verif obsolescence via API"""
     if os_name not in API_MAPPING:
@@ -92,7 +87,9 @@ def get_eol_status(os_name):
     product_slug, version = API_MAPPING[os_name]
     
     # appel API
-    eol_date_str = fetch_eol_date_from_api(product_slug, version)
+    audit_config = config.get_audit_config()
+    timeout = audit_config.api_timeout if audit_config else 2
+    eol_date_str = fetch_eol_date_from_api(product_slug, version, timeout)
     
     # fallback si API échoue (mode hors ligne ou API down)
     if not eol_date_str:
@@ -110,6 +107,7 @@ def get_eol_status(os_name):
     except ValueError:
         return "Date invalide", eol_date_str
 
+@metrics.timed("audit.scan_single_host")
 def scan_single_host(ip_str, ports_to_scan):
     open_ports = []
     is_alive = False
@@ -130,67 +128,80 @@ def scan_single_host(ip_str, ports_to_scan):
 def scan_subnet_and_export(profile, ports_to_scan):
     """scan network, OS & EOL + CSV"""
     
-    cidr = profile['cidr']
-    net_name = profile['network_name']
+    net_name = profile.network_name
     
-    print(f"\n[*] Démarrage de l'audit sur : {net_name} ({cidr})")
+    print(f"\n[*] Démarrage de l'audit sur : {net_name} ({', '.join(profile.cidrs)})")
     
     # prep fichier CSV
+    filepath = report_path(net_name)
+
+    # plages déjà calculées (exclusions comprises) au chargement de la config
+    targets = array('L', profile.ranges)
+    print(f"[*] Analyse de {profile.host_count} adresses IPs...")
+
+    results_to_write = []
+
+    # scan parallele
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = stream_map(executor, scan_single_host, iter_targets(targets), MAX_IN_FLIGHT, ports_to_scan)
+
+        for ip_str, is_alive, open_ports in results:
+            metrics.incr("audit.hosts_scanned")
+            if is_alive:
+                metrics.incr("audit.hosts_alive")
+                results_to_write.append(build_host_record(ip_str, open_ports))
+
+    export_results(filepath, results_to_write, ports_to_scan)
+
+@metrics.timed("audit.gethostbyaddr")
+def resolve_hostname(ip_str):
+    try :
+        return socket.gethostbyaddr(ip_str)[0]
+    except:
+        return "N/A"
+
+def build_host_record(ip_str, open_ports, hostname=None):
+    """DNS, OS & EOL d'une machine vivante -> ligne du rapport"""
+    # reverse dns
+    if hostname is None:
+        hostname = resolve_hostname(ip_str)
+    
+    # os
+    os_detected = KNOWN_HOSTS.get(ip_str, "OS Inconnu")
+
+    # display firewall for pfsense
+    if hostname == "N/A" and "pfSense" in os_detected:
+        hostname == "Firewall"
+
+    # eol
+    status_eol, date_eol = get_eol_status(os_detected)
+
+    return {
+        'IP': ip_str,
+        'Nom (DNS)': hostname,
+        'OS Détecté': os_detected,
+        'Statut Support (EOL)': status_eol,
+        'Date Fin Support': date_eol,
+        'Ports Ouverts': str(open_ports)
+    }
+
+def report_path(net_name):
     if not os.path.exists(LOGS_DIR):
         os.makedirs(LOGS_DIR)
         
     safe_name = "".join([c if c.isalnum() else "_" for c in net_name])
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"AUDIT_{safe_name}_{timestamp}.csv"
-    filepath = os.path.join(LOGS_DIR, filename)
-
-    try:
-        network = ipaddress.IPv4Network(cidr, strict=False)
-    except ValueError:
-        print("[!] CIDR invalide.")
-        return
-
-    all_hosts = list(network.hosts())
-    total_hosts = len(all_hosts)
-    print(f"[*] Analyse de {total_hosts} adresses IPs...")
-
-    results_to_write = []
-
-    # scan parallele
-    with concurrent.futures.ThreadPoolExecutor(max_workers=127) as executor:
-        futures = {executor.submit(scan_single_host, str(ip), ports_to_scan): ip for ip in all_hosts}
+    return os.path.join(LOGS_DIR, filename)
 
-        for future in concurrent.futures.as_completed(futures):
-            ip_str, is_alive, open_ports = future.result()
+def export_results(filepath, results_to_write, ports_scanned):
+    """tri par IP, affichage + CSV"""
+    results_to_write.sort(key=lambda x: ip_to_int(x['IP']))
 
-            if is_alive:
-                # reverse dns
-                try :
-                    hostname = socket.gethostbyaddr(ip_str)[0]
-                except:
-                    hostname = "N/A"
-                
-                # os
-                os_detected = KNOWN_HOSTS.get(ip_str, "OS Inconnu")
-
-                # display firewall for pfsense
-                if hostname == "N/A" and "pfSense" in os_detected:
-                    hostname == "Firewall"
-
-                # eol
-                status_eol, date_eol = get_eol_status(os_detected)
-
-                # results
-                results_to_write.append({
-                    'IP': ip_str,
-                    'Nom (DNS)': hostname,
-                    'OS Détecté': os_detected,
-                    'Statut Support (EOL)': status_eol,
-                    'Date Fin Support': date_eol,
-                    'Ports Ouverts': str(open_ports)
-                })
-
-    results_to_write.sort(key=lambda x: ipaddress.IPv4Address(x['IP']))
+    # ports testés -> l'historique distingue "fermé" de "non testé"
+    tested = str(sorted(ports_scanned))
+    for res in results_to_write:
+        res['Ports Testés'] = tested
 
     # display
     for res in results_to_write:
@@ -198,11 +209,12 @@ def scan_subnet_and_export(profile, ports_to_scan):
 
     # csv
     try:
-        with open(filepath, 'w', newline='', encoding='utf-8-sig') as csvfile:
-            fieldnames = ['IP', 'Nom (DNS)', 'OS Détecté', 'Statut Support (EOL)', 'Date Fin Support', 'Ports Ouverts']
+        with metrics.timer("audit.export_csv"), open(filepath, 'w', newline='', encoding='utf-8-sig') as csvfile:
+            fieldnames = ['IP', 'Nom (DNS)', 'OS Détecté', 'Statut Support (EOL)', 'Date Fin Support', 'Ports Ouverts', 'Ports Testés']
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter=';')
             writer.writeheader()
             writer.writerows(results_to_write)
+            metrics.incr("audit.rows_written", len(results_to_write))
 
             print(f"\n\n[OK] Scan terminé. {len(results_to_write)} machines trouvées.")
             print(f"[FICHIER] Rapport généré : {filepath}")
@@ -211,34 +223,48 @@ def scan_subnet_and_export(profile, ports_to_scan):
         print(f"\n[ERREUR] Problème lors de l'écriture CSV : {e}")
 
 def scan_menu():
-    config = load_config()
-
     while True:
+        audit_config = config.get_audit_config()
+
         clear_screen()
         print("\n--- MODULE AUDIT & OBSOLESCENCE ---")
         
-        if not config:
+        if not audit_config:
             print("[!] Erreur: Fichier configs/audit.json manquant ou invalide.")
             wait_for_user()
             return
 
-        profiles = config.get("scan_profiles", [])
+        profiles = audit_config.scan_profiles
         for i, profile in enumerate(profiles):
-            print(f"{i + 1}. Auditer {profile['network_name']} ({profile['cidr']})")
+            print(f"{i + 1}. Auditer {profile.network_name} ({', '.join(profile.cidrs)})")
         
+        print("a. Auditer tous les réseaux")
+        print("d. Audit distribué (coordinateur + workers sur site)")
         print("q. Retour")
         
         choice = input("Votre choix : ")
+        ports = audit_config.ports_to_scan
 
         if choice.isdigit():
             index = int(choice) - 1
             if 0 <= index < len(profiles):
                 target = profiles[index]
-                ports = config.get("ports_to_scan", [21, 22, 80, 445])
 
-                scan_subnet_and_export(target, ports)
+                with metrics.run("audit"):
+                    scan_subnet_and_export(target, ports)
                 wait_for_user()
             else:
                 print("Choix invalide.")
+        elif choice == 'a':
+            # profils fusionnés -> les plages qui se chevauchent ne sont scannées qu'une fois
+            target = config.merge_profiles("Tous les reseaux", profiles)
+            with metrics.run("audit"):
+                scan_subnet_and_export(target, ports)
+            wait_for_user()
+        elif choice == 'd':
+            from . import distributed
+            with metrics.run("audit_distribue"):
+                distributed.run_coordinator(profiles, ports, audit_config.distributed)
+            wait_for_user()
         elif choice == 'q':
             break
\ No newline at end of file
@@ -3,50 +3,44 @@ import subprocess
 import mysql.connector
 import csv
 import paramiko
-import json
 import gzip
-import shutil
+import tempfile
+import threading
 from datetime import datetime
 from cryptography.fernet import Fernet
 from .utils import *
+from . import metrics, config, scheduler
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE = os.path.join(CURRENT_DIR, "configs", "backup.json")
-KEY_FILE = os.path.join(CURRENT_DIR, "configs", "secret.key")
+KEY_FILE = config.KEY_FILE
+CSV_BATCH_ROWS = 5000
 
-def load_config():
-    if not os.path.exists(CONFIG_FILE):
-        print(f"[ERREUR] Config introuvable : {CONFIG_FILE}")
-        return None
-    try:
-        with open(CONFIG_FILE, 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"[ERREUR] Lecture JSON : {e}")
-        return None
+# évite que deux jobs parallèles génèrent chacun une clé différente
+_key_lock = threading.Lock()
 
 def load_key():
-    if not os.path.exists(KEY_FILE):
-        print(f"[INFO] Aucune clé trouvée. Génération d'une nouvelle clé 'secret.key'...")
-        key = Fernet.generate_key()
-        with open(KEY_FILE, 'wb') as key_file:
-            key_file.write(key)
-        print(f"[IMP] Clé sauvegardée dans {KEY_FILE}.")
+    with _key_lock:
+        if not os.path.exists(KEY_FILE):
+            print(f"[INFO] Aucune clé trouvée. Génération d'une nouvelle clé 'secret.key'...")
+            key = Fernet.generate_key()
+            with open(KEY_FILE, 'wb') as key_file:
+                key_file.write(key)
+            print(f"[IMP] Clé sauvegardée dans {KEY_FILE}.")
 
-    try:
-        with open(KEY_FILE, 'rb') as key_file:
-            return key_file.read()
-    except Exception as e:
-        print(f"[ERREUR] Lecture fichier clé : {e}")
-        return None
+    # clé en cache, relue seulement si secret.key change
+    key = config.get_secret_key()
+    if not key:
+        print(f"[ERREUR] Lecture fichier clé : {KEY_FILE}")
+    return key
 
 def create_temp_dir():
     """crée un dossier avant """
     temp_dir = "backups_wms"
-    if not os.path.exists(temp_dir):
-        os.makedirs(temp_dir)
+    # exist_ok : plusieurs jobs parallèles peuvent le créer en même temps
+    os.makedirs(temp_dir, exist_ok=True)
     return temp_dir
 
+@metrics.timed("backup.encrypt")
 def encrypt_file(input_path, output_path, key):
     try:
         fernet = Fernet(key)
@@ -55,6 +49,7 @@ def encrypt_file(input_path, output_path, key):
             original_data = f.read()
 
         encrypted_data = fernet.encrypt(original_data)
+        metrics.add_bytes("backup.encrypt", len(original_data))
 
         with open(output_path, 'wb') as f:
             f.write(encrypted_data)
@@ -64,9 +59,10 @@ def encrypt_file(input_path, output_path, key):
         print(f"[ERREUR] Chiffrement échoué : {e}")
         return False
 
-def transfer_to_nas(local_path, filename, nas_config):
+@metrics.timed("backup.transfer_to_nas")
+def transfer_to_nas(local_path, filename, nas_config, bucket=None):
     """envoie fichier -> NAS + supprime copie locale si succès"""
-    print(f"[*] Transfert de {filename} vers le NAS ({nas_config['host']})...")
+    print(f"[*] Transfert de {filename} vers le NAS ({nas_config.host})...")
     
     try:
         # creer client SSH
@@ -75,25 +71,35 @@ def transfer_to_nas(local_path, filename, nas_config):
         
         # connect
         ssh.connect(
-            nas_config["host"], 
-            username=nas_config["user"], 
-            password=nas_config["password"]
+            nas_config.host, 
+            username=nas_config.user, 
+            password=nas_config.password
         )
         
         sftp = ssh.open_sftp()
         
         # check dossier distant existant sinon creer
         try:
-            sftp.chdir(nas_config["remote_dir"])
+            sftp.chdir(nas_config.remote_dir)
         except IOError:
             print(f"[INFO] Le dossier distant n'existe pas, tentative de création...")
-            sftp.mkdir(nas_config["remote_dir"])
-            sftp.chdir(nas_config["remote_dir"])
+            try:
+                sftp.mkdir(nas_config.remote_dir)
+            except IOError:
+                # créé entre-temps par un autre job de la file
+                pass
+            sftp.chdir(nas_config.remote_dir)
 
         # envoi fichier
-        remote_path = os.path.join(nas_config["remote_dir"], filename)
+        remote_path = os.path.join(nas_config.remote_dir, filename)
         
-        sftp.put(local_path, remote_path)
+        if bucket:
+            # envoi limité en débit (seau partagé entre les jobs)
+            with open(local_path, 'rb') as f:
+                sftp.putfo(scheduler.ThrottledReader(f, bucket), remote_path, file_size=os.path.getsize(local_path))
+        else:
+            sftp.put(local_path, remote_path)
+        metrics.add_bytes("backup.transfer_to_nas", metrics.file_size(local_path))
         sftp.close()
         ssh.close()
         
@@ -110,141 +116,211 @@ def transfer_to_nas(local_path, filename, nas_config):
         print(f"[INFO] Le fichier est conservé localement ici : {local_path}")
         return False
 
-def perform_sql_dump(config):
-    """dump complet de la base via mysqldump"""
-    db = config['database']
-    tools = config['tools']
-    nas = config['nas']
+def perform_sql_dump(backup_config, db_name=None, limits=None):
+    """dump complet de la base via mysqldump (flux -> gzip, débit et priorité limités)"""
+    db = backup_config.database
+    nas = backup_config.nas
+    db_name = db_name or db.db_name
+    limits = limits or scheduler.Limits(scheduler.current_policy(backup_config.scheduling), backup_config.scheduling)
 
     key = load_key()
     
-    print("\n[*] Démarrage de la sauvegarde SQL sécurisée...")
+    print(f"\n[*] Démarrage de la sauvegarde SQL sécurisée ({db_name})...")
     
     # crée fichier horodaté
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     temp_dir = create_temp_dir()
 
-    raw_sql = os.path.join(temp_dir, f"temp_{timestamp}.sql")
-    compressed_sql = raw_sql + ".gz"
-    final_filename = f"backup_{db['db_name']}_{timestamp}.zsql.enc"
+    compressed_sql = os.path.join(temp_dir, f"temp_{db_name}_{timestamp}.sql.gz")
+    final_filename = f"backup_{db_name}_{timestamp}.zsql.enc"
     final_path = os.path.join(temp_dir, final_filename) 
 
     command = [
-        tools['mysqldump_path'],
-        f"-h{db['host']}",
-        f"-u{db['user']}",
-        f"-p{db['password']}",
-        db['db_name']
+        backup_config.mysqldump_path,
+        f"-h{db.host}",
+        f"-u{db.user}",
+        f"-p{db.password}",
+        db_name
     ]
-    if not db['password']: command.pop(3)
+    if not db.password: command.pop(3)
+
+    # dump ralenti -> pas de --lock-tables (verrous READ tenus tout le dump, écritures WMS bloquées) :
+    # snapshot InnoDB cohérent sans verrou + lecture ligne à ligne
+    # (dès qu'une politique ralentit : un dump de nuit peut déborder sur la journée)
+    if limits.dump.rate > 0 or limits.priority != "normal" or scheduler.may_throttle(backup_config.scheduling):
+        command[-1:-1] = ["--single-transaction", "--quick"]
 
+    # priorité basse (nice/ionice ou BELOW_NORMAL) selon la politique
+    # NB : ne ralentit que le client mysqldump, pas les E/S du serveur mysqld
+    prefix, popen_options = scheduler.process_options(limits.priority)
+
+    process = None
     try:
-        # dump
-        with open(raw_sql, 'w') as outfile:
-            subprocess.run(command, stdout=outfile, stderr=subprocess.PIPE, check=True, text=True)
-        
-        # comp gzip
-        with open(raw_sql, 'rb') as f_in:
-            with gzip.open(compressed_sql, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        # dump lu en flux, limité par le seau à jetons, compressé à la volée
+        with metrics.timer("backup.mysqldump"), tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(prefix + command, stdout=subprocess.PIPE, stderr=errors, **popen_options)
+            # priorité abaissée si la plage horaire change pendant le dump
+            limits.register(process)
+            with process.stdout, gzip.open(compressed_sql, 'wb') as f_out:
+                while True:
+                    chunk = process.stdout.read(scheduler.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    limits.dump.consume(len(chunk))
+                    metrics.add_bytes("backup.mysqldump", len(chunk))
+                    with metrics.timer("backup.gzip"):
+                        f_out.write(chunk)
+            if process.wait() != 0:
+                errors.seek(0)
+                raise subprocess.CalledProcessError(process.returncode, command[0], stderr=errors.read())
 
         # chiffrement
         encrypt_file(compressed_sql, final_path, key)
 
         # clean up
-        if os.path.exists(raw_sql): os.remove(raw_sql)
         if os.path.exists(compressed_sql): os.remove(compressed_sql)
 
         print(f"[SUCCÈS] Sauvegarde SQL chiffrée générée: {final_path}")
-        transfer_to_nas(final_path, final_filename, nas)
-        return True
+        return transfer_to_nas(final_path, final_filename, nas, limits.upload)
     
-    except Exception as err:
-        print(f"[ERREUR] Processus de sauvegarde : {err}")
-        return False
     except subprocess.CalledProcessError as e:
         print(f"[ERREUR] Échec de mysqldump. Code: {e.returncode}")
         print(f"Assurez-vous que 'mysqldump' est installé sur cette machine.")
+        if os.path.exists(compressed_sql): os.remove(compressed_sql)
         return False
     except FileNotFoundError:
         print("[ERREUR] Commande 'mysqldump' introuvable. Est-elle dans le PATH ?")
+        if os.path.exists(compressed_sql): os.remove(compressed_sql)
+        return False
+    except Exception as err:
+        print(f"[ERREUR] Processus de sauvegarde : {err}")
+        if process and process.poll() is None:
+            process.kill()
+            process.wait()
+        if os.path.exists(compressed_sql): os.remove(compressed_sql)
         return False
+    finally:
+        if process:
+            limits.unregister(process)
 
-def export_table_csv(config):
+def export_table_csv(backup_config, table_name=None, limits=None):
     """exporte table spécifique en csv"""
-    db = config['database']
-    nas = config['nas']
+    db = backup_config.database
+    nas = backup_config.nas
+    limits = limits or scheduler.Limits(scheduler.current_policy(backup_config.scheduling), backup_config.scheduling)
 
     key = load_key()
 
-    table_name = input("Table à exporter en CSV : ")
+    if not table_name:
+        table_name = input("Table à exporter en CSV : ")
     print(f"\n[*] Export de la table '{table_name}' en CSV...")
     
+    raw_csv_path = None
     try:
         conn = mysql.connector.connect(
-            host=db['host'],
-            user=db['user'],
-            password=db["password"],
-            database=db["db_name"]
+            host=db.host,
+            user=db.user,
+            password=db.password,
+            database=db.db_name
         )
         cursor = conn.cursor()
-        cursor.execute(f"SELECT * FROM {table_name}")
         
-        # récupération des données et des en-têtes
-        rows = cursor.fetchall()
+        with metrics.timer("backup.query"):
+            cursor.execute(f"SELECT * FROM {table_name}")
         headers = [i[0] for i in cursor.description]
         
         # écriture du CSV
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         temp_dir = create_temp_dir()
 
-        raw_csv_path = os.path.join(temp_dir, f"temp_{table_name}.csv")
+        raw_csv_path = os.path.join(temp_dir, f"temp_{table_name}_{timestamp}.csv")
         filename = f"export_{table_name}_{timestamp}.csv.enc"
         local_path = os.path.join(temp_dir, filename)
         
-        with open(raw_csv_path, 'w', newline='', encoding='utf-8-sig') as f:
+        # lecture par lots : mémoire bornée, débit limité comme le dump SQL
+        row_count = 0
+        with metrics.timer("backup.write_csv"), open(raw_csv_path, 'w', newline='', encoding='utf-8-sig') as f:
             writer = csv.writer(f, delimiter=';')
             writer.writerow(headers)
-            writer.writerows(rows)
+            while True:
+                rows = cursor.fetchmany(CSV_BATCH_ROWS)
+                if not rows:
+                    break
+                start = f.tell()
+                writer.writerows(rows)
+                limits.dump.consume(f.tell() - start)
+                row_count += len(rows)
+        metrics.incr("backup.rows_exported", row_count)
+        metrics.add_bytes("backup.write_csv", metrics.file_size(raw_csv_path))
 
-        encrypt_file(raw_csv_path, local_path, key)
-            
-        print(f"[SUCCÈS] Export CSV généré : {filename} ({len(rows)} lignes)")
-        
         cursor.close()
         conn.close()
 
-        transfer_to_nas(local_path, filename, nas)
-        return True
+        encrypt_file(raw_csv_path, local_path, key)
+        # CSV en clair -> supprimé dès qu'il est chiffré
+        os.remove(raw_csv_path)
+            
+        print(f"[SUCCÈS] Export CSV généré : {filename} ({row_count} lignes)")
+
+        return transfer_to_nas(local_path, filename, nas, limits.upload)
 
     except mysql.connector.Error as err:
         print(f"[ERREUR MySQL] {err}")
+        if raw_csv_path and os.path.exists(raw_csv_path): os.remove(raw_csv_path)
         return False
+    except OSError as err:
+        print(f"[ERREUR] Export CSV : {err}")
+        if raw_csv_path and os.path.exists(raw_csv_path): os.remove(raw_csv_path)
+        return False
+
+def run_backup_queue(backup_config):
+    """sauvegarde toutes les bases et tables de scheduling.jobs selon la politique horaire"""
+    scheduling = backup_config.scheduling
+    if scheduling.defer_to_window:
+        scheduler.wait_for_window(scheduling)
+
+    jobs = []
+    for db_name in scheduling.databases:
+        jobs.append((f"dump {db_name}", lambda limits, db_name=db_name: perform_sql_dump(backup_config, db_name, limits)))
+    for table_name in scheduling.tables:
+        jobs.append((f"table {table_name}", lambda limits, table_name=table_name: export_table_csv(backup_config, table_name, limits)))
+
+    if not jobs:
+        print("[INFO] Aucun job dans scheduling.jobs (backup.json).")
+        return []
+    return scheduler.run_queue(jobs, scheduling)
 
 def run_backup_menu():
     """Sous-menu pour le module de sauvegarde."""
-    config = load_config()
-    if not config:
+    if not config.get_backup_config():
         print("\n[ERREUR CRITIQUE] Impossible de charger la configuration backup.")
         print("Vérifiez le fichier modules/configs/backup.json")
         wait_for_user() 
         return
 
     while True:
+        backup_config = config.get_backup_config()
         clear_screen()
 
         print("\n--- MODULE SAUVEGARDE WMS ---")
         print("1. Sauvegarde complète (SQL Dump)")
         print("2. Export d'une table (CSV)")
+        print("3. File de sauvegarde planifiée (bases + tables)")
         print("q. Retour au menu principal")
         
         choice = input("Choix : ")
         
         if choice == '1':
-            perform_sql_dump(config)
+            with metrics.run("backup_sql"):
+                perform_sql_dump(backup_config)
             wait_for_user()
         elif choice == '2':
-            export_table_csv(config)
+            with metrics.run("backup_csv"):
+                export_table_csv(backup_config)
+            wait_for_user()
+        elif choice == '3':
+            with metrics.run("backup_queue"):
+                run_backup_queue(backup_config)
             wait_for_user()
         elif choice == 'q':
             break
@@ -0,0 +1,356 @@
+import os
+import json
+import threading
+import ipaddress
+from types import MappingProxyType
+from dataclasses import dataclass
+from . import metrics
+from .targets import build_targets, count_targets, merge_ranges
+
+# service de configuration unique :
+# chaque fichier est lu, validé et compilé une seule fois en objets immuables,
+# puis rechargé seulement si son mtime/sa taille change (menus, démons, workers) :
+# les get_*_config() peuvent donc être appelés à chaque tour de menu
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+CONFIGS_DIR = os.path.join(BASE_DIR, "configs")
+
+ROOT_CONFIG_FILE = os.path.join(ROOT_DIR, "config.json")
+AUDIT_CONFIG_FILE = os.path.join(CONFIGS_DIR, "audit.json")
+BACKUP_CONFIG_FILE = os.path.join(CONFIGS_DIR, "backup.json")
+DIAGNOSTIC_CONFIG_FILE = os.path.join(CONFIGS_DIR, "diagnostic.json")
+KEY_FILE = os.path.join(CONFIGS_DIR, "secret.key")
+
+MACHINE_TYPES = ("local", "linux_ssh", "windows_remote")
+PRIORITIES = ("normal", "low", "idle")
+DEFAULT_PORTS = (21, 22, 80, 445)
+
+@dataclass(frozen=True)
+class GeneralConfig:
+    log_level: str
+    metrics: bool
+    metrics_file: str
+    profile: str
+
+@dataclass(frozen=True)
+class ScanProfile:
+    network_name: str
+    cidrs: tuple
+    description: str
+    exclude: tuple
+    ranges: tuple       # plages [début, fin] à plat, exclusions globales déjà retirées
+    host_count: int
+
+@dataclass(frozen=True)
+class DistributedConfig:
+    bind: str
+    port: int
+    chunk_size: int
+    ports_per_unit: int
+    lease_timeout: int
+    token: str
+
+@dataclass(frozen=True)
+class AuditConfig:
+    scan_profiles: tuple
+    ports_to_scan: tuple
+    exclude: tuple
+    api_timeout: float
+    distributed: DistributedConfig
+
+@dataclass(frozen=True)
+class DatabaseConfig:
+    host: str
+    user: str
+    password: str
+    db_name: str
+
+@dataclass(frozen=True)
+class NasConfig:
+    host: str
+    user: str
+    password: str
+    remote_dir: str
+
+@dataclass(frozen=True)
+class BackupPolicy:
+    name: str
+    upload_kbps: int    # 0 = illimité
+    dump_kbps: int
+    parallelism: int
+    priority: str       # normal, low, idle
+
+@dataclass(frozen=True)
+class TimeWindow:
+    start: int          # minutes depuis minuit
+    end: int
+    policy: BackupPolicy
+
+@dataclass(frozen=True)
+class SchedulingConfig:
+    default: BackupPolicy
+    windows: tuple
+    databases: tuple
+    tables: tuple
+    defer_to_window: bool
+
+@dataclass(frozen=True)
+class BackupConfig:
+    database: DatabaseConfig
+    nas: NasConfig
+    mysqldump_path: str
+    scheduling: SchedulingConfig
+
+@dataclass(frozen=True)
+class Machine:
+    key: str
+    name: str
+    type: str
+    ip: str
+    user: str
+    password: str
+
+@dataclass(frozen=True)
+class DiagnosticConfig:
+    machines: MappingProxyType     # clé du menu -> Machine
+    by_name: MappingProxyType
+
+_lock = threading.Lock()
+_cache = {}     # nom -> (empreinte fichiers, objet compilé)
+
+def _read_json(path, required=True):
+    if not os.path.exists(path):
+        if required:
+            raise ValueError(f"fichier introuvable : {path}")
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"objet JSON attendu dans {path}")
+    return data
+
+def _fingerprint(paths):
+    stamp = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def _cached(name, paths, builder):
+    """recompile seulement si un des fichiers a changé ; garde la dernière version valide en cas d'erreur"""
+    stamp = _fingerprint(paths)
+    with _lock:
+        entry = _cache.get(name)
+        if entry and entry[0] == stamp:
+            return entry[1]
+
+        try:
+            value = builder()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[ERREUR] Configuration {name} invalide : {e}")
+            value = entry[1] if entry else None
+
+        _cache[name] = (stamp, value)
+        return value
+
+def _port(value):
+    port = int(value)
+    if not 0 < port < 65536:
+        raise ValueError(f"port invalide : {value}")
+    return port
+
+def _build_general():
+    general = _read_json(ROOT_CONFIG_FILE, required=False).get("general", {})
+    section = general.get("metrics", {})
+    return GeneralConfig(
+        log_level=str(general.get("log_level", "INFO")),
+        metrics=bool(section.get("enabled", False)),
+        metrics_file=section.get("file") or "",
+        profile=section.get("profile") or ""
+    )
+
+def _build_profile(raw, global_exclude):
+    if raw.get("cidrs"):
+        cidrs = tuple(raw["cidrs"])
+    else:
+        cidrs = (raw["cidr"],)
+    exclude = tuple(raw.get("exclude", []))
+
+    targets = build_targets(cidrs, global_exclude + exclude)
+    return ScanProfile(
+        network_name=str(raw["network_name"]),
+        cidrs=cidrs,
+        description=str(raw.get("description", "")),
+        exclude=exclude,
+        ranges=tuple(targets),
+        host_count=count_targets(targets)
+    )
+
+def merge_profiles(network_name, profiles):
+    """profil unique couvrant plusieurs profils (chevauchements fusionnés)"""
+    ranges = merge_ranges([(p.ranges[i], p.ranges[i + 1]) for p in profiles for i in range(0, len(p.ranges), 2)])
+    flat = tuple(value for pair in ranges for value in pair)
+    return ScanProfile(
+        network_name=network_name,
+        cidrs=tuple(cidr for p in profiles for cidr in p.cidrs),
+        description="",
+        exclude=(),
+        ranges=flat,
+        host_count=sum(end - start + 1 for start, end in ranges)
+    )
+
+def _build_audit():
+    raw = _read_json(AUDIT_CONFIG_FILE)
+    global_exclude = tuple(raw.get("exclude", []))
+
+    raw_profiles = raw.get("scan_profiles", [])
+    if not raw_profiles:
+        # repli sur le sous-réseau du config.json racine
+        subnet = _read_json(ROOT_CONFIG_FILE, required=False).get("network", {}).get("target_subnet")
+        if subnet:
+            raw_profiles = [{"network_name": "Réseau par défaut", "cidr": subnet}]
+
+    ports = tuple(_port(p) for p in raw.get("ports_to_scan", DEFAULT_PORTS))
+    dist = raw.get("distributed", {})
+    chunk_size = int(dist.get("chunk_size", 64))
+    ports_per_unit = int(dist.get("ports_per_unit", 0))
+    lease_timeout = int(dist.get("lease_timeout", 60))
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size doit être >= 1 : {chunk_size}")
+    if ports_per_unit < 0:
+        raise ValueError(f"ports_per_unit doit être >= 0 : {ports_per_unit}")
+    if lease_timeout < 1:
+        raise ValueError(f"lease_timeout doit être >= 1 : {lease_timeout}")
+
+    return AuditConfig(
+        scan_profiles=tuple(_build_profile(p, global_exclude) for p in raw_profiles),
+        ports_to_scan=ports,
+        exclude=global_exclude,
+        api_timeout=float(raw.get("api_timeout", 2)),
+        distributed=DistributedConfig(
+            bind=str(dist.get("bind", "127.0.0.1")),
+            port=_port(dist.get("port", 9750)),
+            chunk_size=chunk_size,
+            ports_per_unit=ports_per_unit,
+            lease_timeout=lease_timeout,
+            token=str(dist.get("token", ""))
+        )
+    )
+
+def _time_of_day(value):
+    """'20:30' -> minutes depuis minuit"""
+    hours, minutes = str(value).split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"heure invalide : {value}")
+    return hours * 60 + minutes
+
+def _build_policy(raw, name):
+    priority = raw.get("priority", "normal")
+    if priority not in PRIORITIES:
+        raise ValueError(f"priorité inconnue : {priority}")
+    return BackupPolicy(
+        name=str(raw.get("name", name)),
+        upload_kbps=max(0, int(raw.get("upload_kbps", 0))),
+        dump_kbps=max(0, int(raw.get("dump_kbps", 0))),
+        parallelism=max(1, int(raw.get("parallelism", 1))),
+        priority=priority
+    )
+
+def _build_scheduling(raw, db_name):
+    windows = tuple(
+        TimeWindow(
+            start=_time_of_day(w["start"]),
+            end=_time_of_day(w["end"]),
+            policy=_build_policy(w, f"{w['start']}-{w['end']}")
+        )
+        for w in raw.get("windows", [])
+    )
+    jobs = raw.get("jobs", {})
+    return SchedulingConfig(
+        default=_build_policy(raw.get("default", {}), "Par défaut"),
+        windows=windows,
+        databases=tuple(jobs.get("databases") or [db_name]),
+        tables=tuple(jobs.get("tables", [])),
+        defer_to_window=bool(raw.get("defer_to_window", False))
+    )
+
+def _build_backup():
+    raw = _read_json(BACKUP_CONFIG_FILE)
+
+    # base : valeurs du config.json racine, surchargées par backup.json
+    db = dict(_read_json(ROOT_CONFIG_FILE, required=False).get("database", {}))
+    db.update(raw.get("database", {}))
+    nas = raw["nas"]
+
+    return BackupConfig(
+        database=DatabaseConfig(
+            host=db["host"],
+            user=db["user"],
+            password=db.get("password", ""),
+            db_name=db["db_name"]
+        ),
+        nas=NasConfig(
+            host=nas["host"],
+            user=nas["user"],
+            password=nas.get("password", ""),
+            remote_dir=nas["remote_dir"]
+        ),
+        mysqldump_path=raw.get("tools", {}).get("mysqldump_path", "mysqldump"),
+        scheduling=_build_scheduling(raw.get("scheduling", {}), db["db_name"])
+    )
+
+def _build_diagnostic():
+    raw = _read_json(DIAGNOSTIC_CONFIG_FILE)
+
+    machines = {}
+    for key, entry in raw.items():
+        machine_type = entry["type"]
+        if machine_type not in MACHINE_TYPES:
+            raise ValueError(f"type inconnu pour {key} : {machine_type}")
+        ipaddress.IPv4Address(entry["ip"])
+        machines[str(key)] = Machine(
+            key=str(key),
+            name=entry["name"],
+            type=machine_type,
+            ip=entry["ip"],
+            user=entry.get("user"),
+            password=entry.get("password")
+        )
+
+    return DiagnosticConfig(
+        machines=MappingProxyType(machines),
+        by_name=MappingProxyType({m.name: m for m in machines.values()})
+    )
+
+def get_general_config():
+    return _cached("general", [ROOT_CONFIG_FILE], _build_general)
+
+def get_audit_config():
+    return _cached("audit", [AUDIT_CONFIG_FILE, ROOT_CONFIG_FILE], _build_audit)
+
+def get_backup_config():
+    return _cached("backup", [BACKUP_CONFIG_FILE, ROOT_CONFIG_FILE], _build_backup)
+
+def get_diagnostic_config():
+    return _cached("diagnostic", [DIAGNOSTIC_CONFIG_FILE], _build_diagnostic)
+
+def _read_key():
+    with open(KEY_FILE, 'rb') as key_file:
+        return key_file.read().strip()
+
+def get_secret_key():
+    """clé Fernet en cache (relue seulement si secret.key change)"""
+    if not os.path.exists(KEY_FILE):
+        return None
+    return _cached("secret.key", [KEY_FILE], _read_key)
+
+def setup_metrics():
+    """applique la section general.metrics du config.json racine"""
+    general = get_general_config()
+    if general:
+        metrics.configure(general.metrics, general.metrics_file, general.profile)
@@ -1,31 +1,20 @@
 import os
-import psutil
 import platform
 import time
 import socket
 import paramiko
 import json
+import struct
+import subprocess
+import concurrent.futures
 from datetime import datetime
 from .utils import *
+from . import metrics, config
 
 BASE_DIR = os.path.dirname(__file__)
-CONFIG_FILE = os.path.join(os.path.dirname(__file__), "configs", "diagnostic.json")
 LOGS_DIR = os.path.join(BASE_DIR, "logs")
 
-def load_inventory():
-    """"load config depuis json"""
-    if not os.path.exists(CONFIG_FILE):
-        print(f"[ERREUR] Le fichier de configuration est introuvable : {CONFIG_FILE}")
-        return {}
-    
-    try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except json.JSONDecodeError as e:
-        print(f"[ERREUR] Le fichier JSON est mal formaté : {e}")
-        return {}
-
-def save_report_json(machine_name, data):
+def save_report_json(machine_name, data, ip=None):
     """exporter le dic de données -> JSON"""
     if not os.path.exists(LOGS_DIR):
         try:
@@ -41,6 +30,7 @@ def save_report_json(machine_name, data):
 
     full_report = {
         "machine": machine_name,
+        "ip": ip,
         "scan_date": datetime.now().isoformat(),
         "scan_result": data
     }
@@ -52,6 +42,7 @@ def save_report_json(machine_name, data):
     except Exception as e:
         print(f"\n[ERREUR] Échec de l'export JSON : {e}")
 
+@metrics.timed("diagnostic.ssh_health")
 def get_remote_linux_health(ip, user, password):
     """connecte SSH + commandes Linux pour récup l'état"""
     print(f"[*] Connexion SSH vers {ip}...")
@@ -93,53 +84,127 @@ def get_remote_linux_health(ip, user, password):
     except Exception as e:
         return {"ERREUR": f"Connexion impossible ou échec commandes: {e}"}
 
-def check_simple_ports(ip, ports):
-    """pour machines Windows sans SSH, vérifier juste les ports"""
+PROBE_TIMEOUT = 1.0
+DETECTION_PORTS = [22, 445, 3389]
+WINDOWS_PORTS = [135, 445, 3389]
+WINRM_PORTS = [5985, 5986]
+
+# SMB1 Negotiate proposant aussi SMB2 -> un serveur SMB répond \xffSMB ou \xfeSMB
+_SMB_DIALECTS = b"\x02NT LM 0.12\x00\x02SMB 2.002\x00\x02SMB 2.???\x00"
+_SMB_HEADER = (b"\xffSMB\x72" + b"\x00" * 4 + b"\x18\x01\x48" + b"\x00" * 12
+               + b"\x00\x00\xff\xfe\x00\x00\x00\x00")
+_SMB_BODY = _SMB_HEADER + b"\x00" + struct.pack("<H", len(_SMB_DIALECTS)) + _SMB_DIALECTS
+SMB_NEGOTIATE = b"\x00" + struct.pack(">I", len(_SMB_BODY))[1:] + _SMB_BODY
+
+# RDP : TPKT + X.224 Connection Request + RDP_NEG_REQ (TLS/CredSSP)
+RDP_CONNECTION_REQUEST = b"\x03\x00\x00\x13\x0e\xe0\x00\x00\x00\x00\x00\x01\x00\x08\x00\x03\x00\x00\x00"
+
+def ping_host(ip, timeout=PROBE_TIMEOUT):
+    """ping ICMP via la commande système -> 'OK', 'Timeout' ou 'Erreur Commande'"""
+    if platform.system().lower() == 'windows':
+        command = ['ping', '-n', '1', '-w', str(int(timeout * 1000)), ip]
+    else:
+        command = ['ping', '-c', '1', '-W', str(max(1, int(timeout))), ip]
+
+    try:
+        with metrics.timer("diagnostic.ping"):
+            response = subprocess.run(
+                command,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=timeout + 1
+            ).returncode
+        return "OK" if response == 0 else "Timeout"
+    except subprocess.TimeoutExpired:
+        return "Timeout"
+    except Exception:
+        return "Erreur Commande"
+
+def probe_service(ip, port, payload, expected, timeout=PROBE_TIMEOUT):
+    """
+    connexion + envoi d'une requête protocole, dans un seul budget de temps
+    return : (port ouvert, service a répondu)
+    """
+    deadline = time.monotonic() + timeout
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        if sock.connect_ex((ip, port)) != 0:
+            return False, False
+        sock.settimeout(max(deadline - time.monotonic(), 0.05))
+        sock.sendall(payload)
+        response = sock.recv(64)
+        return True, expected(response)
+    except OSError:
+        return True, False
+    finally:
+        sock.close()
+
+def _smb_response(data):
+    return data[4:8] in (b"\xffSMB", b"\xfeSMB")
+
+def _rdp_response(data):
+    return data[:2] == b"\x03\x00"
+
+SERVICES = {
+    445: ("SMB", SMB_NEGOTIATE, _smb_response),
+    3389: ("RDP", RDP_CONNECTION_REQUEST, _rdp_response)
+}
+
+def start_probes(executor, ip, ports, ping=True):
+    """
+    lance d'un coup le ping et tous les tests de ports (SMB/RDP avec réponse protocole)
+    return : {"ping" ou port: future}
+    """
+    futures = {}
+    if ping:
+        futures["ping"] = executor.submit(ping_host, ip)
+    for port in dict.fromkeys(ports):
+        if port in SERVICES:
+            name, payload, expected = SERVICES[port]
+            futures[port] = executor.submit(probe_service, ip, port, payload, expected)
+        else:
+            futures[port] = executor.submit(probe_port, ip, port, PROBE_TIMEOUT)
+    return futures
+
+def probe_result(port, future):
+    """(ouvert, service a répondu ou None)"""
+    if port in SERVICES:
+        return future.result()
+    return future.result(), None
+
+@metrics.timed("diagnostic.check_simple_ports")
+def check_simple_ports(ip, ports, pending=None):
+    """
+    pour machines Windows sans SSH : ping + ports + réponse SMB/RDP + WinRM, tout en parallèle
+    pending : tests déjà lancés par start_probes (en même temps que la détection d'OS), réutilisés
+    """
     print(f"[*] Démarrage du scan détaillé vers {ip}...")
     
     info = {
         "OS": "Windows", 
         "Type": "Scan de Ports"
     }
-    
-    print(f"    > Test du Ping...", end=' ', flush=True)
-    try:
-        param = '-n' if platform.system().lower() == 'windows' else '-c'
-        command = ['ping', param, '1', '-W', '1000', ip] # -W 1000 = Timeout 1s max
-        
-        response = psutil.subprocess.call(
-            command, 
-            stdout=psutil.subprocess.DEVNULL, 
-            stderr=psutil.subprocess.DEVNULL
-        )
-        
-        if response == 0:
-            print("OK")
-            info["Ping"] = "OK"
-        else:
-            print("Timeout")
-            info["Ping"] = "Timeout"
-    except Exception as e:
-        print(f"ERREUR ({e})")
-        info["Ping"] = "Erreur Commande"
 
-    # loop ports
-    for port in ports:
-        print(f"    > Test du port TCP/{port}...", end=' ', flush=True)
-        
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(1.0) # 1 sec max / port
-        result = sock.connect_ex((ip, port))
-        
-        if result == 0:
-            status = "Ouvert"
-            print("Ouvert")
-        else:
-            status = "Fermé"
-            print("Fermé") 
-            
-        info[f"Port {port}"] = status
-        sock.close()
+    all_ports = list(dict.fromkeys(list(ports) + WINRM_PORTS))
+    futures = dict(pending or {})
+    missing = [port for port in all_ports if port not in futures]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(missing) + 1) as executor:
+        futures.update(start_probes(executor, ip, missing, ping="ping" not in futures))
+
+        info["Ping"] = futures["ping"].result()
+        print(f"    > Test du Ping... {info['Ping']}")
+
+        for port in all_ports:
+            is_open, answered = probe_result(port, futures[port])
+            if is_open and answered is not None:
+                info[SERVICES[port][0]] = "Répond" if answered else "Pas de réponse protocole"
+
+            status = "Ouvert" if is_open else "Fermé"
+            label = "WinRM " if port in WINRM_PORTS else ""
+            print(f"    > Test du port {label}TCP/{port}... {status}")
+            info[f"Port {port}"] = status
     
     return info
 
@@ -172,14 +237,13 @@ def display_report(machine_name, data):
     print("="*50 + "\n")
 
 def run_diagnostic():
-    inventory = load_inventory()
-
-    if not inventory:
+    if not config.get_diagnostic_config():
         print("Aucune configuration chargée. Vérifiez configs/diagnostic.json")
         return
 
     while True:
         # clear_screen()
+        inventory = config.get_diagnostic_config().machines
 
         print("\n--- MENU DIAGNOSTIC RÉSEAU ---")
         print("Sélectionnez la machine à scanner :")
@@ -187,7 +251,7 @@ def run_diagnostic():
         keys = sorted(inventory.keys())
         for key in keys:
             val = inventory[key]
-            print(f"{key}. {val['name']} ({val['ip']})")
+            print(f"{key}. {val.name} ({val.ip})")
         
         print("q. Quitter")
         
@@ -200,11 +264,20 @@ def run_diagnostic():
             target = inventory[choice]
             data = {}
             
-            print(f"[*] Détection de l'OS de {target['ip']}...")
-            detected_type = detect_os_type(target['ip'])
+            metrics.start_run("diagnostic")
+            print(f"[*] Détection de l'OS de {target.ip}...")
+            # ping + ports de détection + ports Windows/WinRM lancés ensemble :
+            # une seule fenêtre de timeout, résultats réutilisés par check_simple_ports
+            probe_ports_list = DETECTION_PORTS + WINDOWS_PORTS + WINRM_PORTS
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(probe_ports_list) + 1)
+            pending = start_probes(executor, target.ip, probe_ports_list)
+            # les tests lancés continuent ; on n'attend pas ceux qui ne servent pas (local, SSH)
+            executor.shutdown(wait=False)
+            probes = {port: probe_result(port, pending[port])[0] for port in DETECTION_PORTS}
+            detected_type = detect_os_type(target.ip, probes)
             
-            current_type = target['type']
-            if target['type'] != 'local' and detected_type != 'unknown':
+            current_type = target.type
+            if target.type != 'local' and detected_type != 'unknown':
                 current_type = detected_type
                 print(f"    -> OS Détecté : {current_type}")
             
@@ -217,22 +290,24 @@ def run_diagnostic():
                 elif current_type == "linux_ssh":
                     # analyse distante Linux (SSH)
                     # user/pass necessaire
-                    data = get_remote_linux_health(target["ip"], target.get("user"), target.get("password"))
+                    data = get_remote_linux_health(target.ip, target.user, target.password)
                     
                 elif current_type == "windows_remote":
                     # win detected -> scan ports
-                    data = check_simple_ports(target["ip"], [135, 445, 3389])
+                    data = check_simple_ports(target.ip, WINDOWS_PORTS, pending)
                 
-                display_report(target["name"], data)
+                display_report(target.name, data)
+                metrics.end_run()
 
                 save = input("Voulez-vous exporter ce rapport en JSON? (y/N) : ")
                 if save.lower() == 'y':
-                    save_report_json(target["name"], data)
+                    save_report_json(target.name, data, target.ip)
                 
                 wait_for_user()
                 clear_screen()
                     
             except Exception as e:
+                metrics.end_run()
                 print(f"\n/!\ Une erreur est survenue pendant le scan :")
                 print(f"{e}")
                 print("Vérifiez vos IPs, mots de passe et connexions.")
@@ -0,0 +1,403 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import ipaddress
+import threading
+import subprocess
+import socketserver
+import concurrent.futures
+from array import array
+from collections import deque
+from .utils import *
+from . import audit, metrics, config
+from .targets import chunk_targets, count_targets, iter_targets, stream_map, merge_ranges, subtract_ranges
+
+# protocole : une ligne JSON par message sur TCP
+#   worker -> coord : hello {name, sites, token}
+#   coord -> worker : unit {id, site, ranges, ports, heartbeat} | stop | error {message}
+#   worker -> coord : result {id, hosts: [[ip, ports, hostname], ...]} (0..n fois) puis done {id}
+#   worker -> coord : ping (toutes les `heartbeat` s pendant le scan, signe de vie)
+# si le worker coupe ou ne répond plus (lease_timeout), son unité est remise en file
+# et le worker se reconnecte de lui-même
+
+DEFAULT_PORT = 9750
+CHUNK_SIZE = 64
+LEASE_TIMEOUT = 60
+RESULT_BATCH = 16
+HEARTBEAT_INTERVAL = 10
+
+def send_msg(stream, msg, lock=None):
+    data = (json.dumps(msg) + "\n").encode('utf-8')
+    if lock is None:
+        stream.write(data)
+        stream.flush()
+        return
+    with lock:
+        stream.write(data)
+        stream.flush()
+
+def recv_msg(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+def build_work_units(profiles, ports, chunk_size=CHUNK_SIZE, ports_per_unit=0):
+    """découpe profils (CIDR) x ports en unités de travail, sans doublons entre profils"""
+    units = []
+    covered = []
+    port_groups = [list(ports)]
+    if ports_per_unit:
+        port_groups = [list(ports[i:i + ports_per_unit]) for i in range(0, len(ports), ports_per_unit)]
+
+    for profile in profiles:
+        site = profile.network_name
+        # plages déjà couvertes par un profil précédent -> exclues
+        ranges = [(profile.ranges[i], profile.ranges[i + 1]) for i in range(0, len(profile.ranges), 2)]
+        ranges = subtract_ranges(merge_ranges(ranges), merge_ranges(covered))
+        covered.extend(ranges)
+
+        targets = array('L', [value for pair in ranges for value in pair])
+
+        for chunk in chunk_targets(targets, chunk_size):
+            for group in port_groups:
+                units.append({
+                    "id": len(units),
+                    "site": site,
+                    "ranges": list(chunk),
+                    "ports": group
+                })
+    return units
+
+class Coordinator:
+    """file d'unités de travail partagée entre les connexions workers"""
+
+    def __init__(self, units, lease_timeout=LEASE_TIMEOUT, token=""):
+        self.units = {unit["id"]: unit for unit in units}
+        self.pending = deque(units)
+        self.done = set()
+        self.lease_timeout = lease_timeout
+        self.token = token
+        self.aborted = False
+        self.cond = threading.Condition()
+        # site -> ip -> {"ports": set, "hostname": str}
+        self.results = {}
+
+    def finished(self):
+        return len(self.done) == len(self.units)
+
+    def next_unit(self, sites):
+        """unité du site du worker en priorité, sinon n'importe laquelle ; None = plus rien à faire"""
+        with self.cond:
+            while True:
+                if self.finished() or self.aborted:
+                    return None
+                for unit in self.pending:
+                    if unit["site"] in sites:
+                        self.pending.remove(unit)
+                        return unit
+                if self.pending:
+                    return self.pending.popleft()
+                # tout est en cours : on attend une fin ou une remise en file
+                self.cond.wait(1)
+
+    def complete(self, unit_id, hosts):
+        with self.cond:
+            if unit_id in self.done:
+                return
+            site = self.units[unit_id]["site"]
+            site_results = self.results.setdefault(site, {})
+            for ip, ports, hostname in hosts:
+                entry = site_results.setdefault(ip, {"ports": set(), "hostname": hostname})
+                entry["ports"].update(ports)
+            self.done.add(unit_id)
+            self.cond.notify_all()
+
+    def release(self, unit_id):
+        with self.cond:
+            if unit_id not in self.done:
+                self.pending.appendleft(self.units[unit_id])
+                self.cond.notify_all()
+
+    def abort(self):
+        """plus aucune unité distribuée : les workers reçoivent stop"""
+        with self.cond:
+            self.aborted = True
+            self.cond.notify_all()
+
+    def wait(self):
+        with self.cond:
+            while not self.finished():
+                self.cond.wait(1)
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        coord = self.server.coordinator
+        self.request.settimeout(coord.lease_timeout)
+        unit = None
+        name = f"{self.client_address[0]}:{self.client_address[1]}"
+
+        try:
+            hello = recv_msg(self.rfile)
+            if hello is None:
+                # simple test de port (ex: audit du réseau du coordinateur)
+                return
+            if hello.get("type") != "hello" or hello.get("token", "") != coord.token:
+                print(f"[!] Connexion refusée : {name}")
+                send_msg(self.wfile, {"type": "error", "message": "jeton invalide"})
+                return
+
+            name = hello.get("name") or name
+            sites = hello.get("sites", [])
+            print(f"[INFO] Worker connecté : {name} (sites: {', '.join(sites) or 'tous'})")
+
+            while True:
+                unit = coord.next_unit(sites)
+                if unit is None:
+                    send_msg(self.wfile, {"type": "stop"})
+                    break
+
+                send_msg(self.wfile, {"type": "unit", "heartbeat": max(1, coord.lease_timeout // 3), **unit})
+
+                hosts = []
+                while True:
+                    msg = recv_msg(self.rfile)
+                    if msg is None:
+                        raise ConnectionError("connexion fermée")
+                    if msg.get("type") == "result":
+                        hosts.extend(msg.get("hosts", []))
+                    elif msg.get("type") == "done":
+                        break
+
+                coord.complete(unit["id"], hosts)
+                metrics.incr("distributed.units_done")
+                print(f"    [+] Unité {unit['id']} ({unit['site']}) terminée par {name} "
+                      f"- {len(coord.done)}/{len(coord.units)}")
+                unit = None
+
+        except (OSError, ValueError, ConnectionError) as e:
+            print(f"[!] Worker {name} perdu : {e}")
+        finally:
+            if unit is not None:
+                print(f"[INFO] Unité {unit['id']} remise en file.")
+                metrics.incr("distributed.units_reassigned")
+                coord.release(unit["id"])
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def start_local_workers(count, host, port, token):
+    """lance des workers sur cette machine (tests ou machine unique)"""
+    procs = []
+    for i in range(count):
+        cmd = [sys.executable, "-m", "modules.distributed", "worker",
+               "--coordinator", f"{host}:{port}", "--name", f"local-{i + 1}"]
+        if token:
+            cmd += ["--token", token]
+        procs.append(subprocess.Popen(cmd, cwd=os.path.dirname(audit.BASE_DIR)))
+    return procs
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def run_coordinator(profiles, ports, settings, local_workers=0, port=None):
+    """répartit l'audit sur les workers puis fusionne le tout dans un seul rapport"""
+    port = port or settings.port
+    bind = settings.bind
+    token = settings.token
+
+    # sans jeton, n'importe quelle machine du LAN pourrait injecter des résultats
+    if not token and not is_loopback(bind):
+        print(f"[ERREUR] Écoute sur {bind} refusée sans jeton : renseignez distributed.token "
+              f"dans audit.json (ou bind 127.0.0.1).")
+        return
+
+    units = build_work_units(profiles, ports, settings.chunk_size, settings.ports_per_unit)
+
+    # une IP apparaît dans autant d'unités que de groupes de ports
+    total_hosts = sum(count_targets(array('L', u["ranges"])) for u in units if units and u["ports"] == units[0]["ports"])
+    print(f"\n[*] Audit distribué : {len(profiles)} réseau(x), {total_hosts} adresses IPs, {len(units)} unités")
+
+    coord = Coordinator(units, settings.lease_timeout, token)
+    server = CoordinatorServer((bind, port), WorkerHandler)
+    server.coordinator = coord
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"[*] Coordinateur en écoute sur {bind}:{port}, en attente des workers...")
+
+    procs = start_local_workers(local_workers, "127.0.0.1", port, token) if local_workers else []
+
+    aborted = False
+    try:
+        coord.wait()
+    except KeyboardInterrupt:
+        print("\n[!] Audit distribué interrompu.")
+        aborted = True
+        coord.abort()
+        return
+    finally:
+        server.shutdown()
+        server.server_close()
+        if aborted:
+            # workers locaux arrêtés tous ensemble, pas 10 s chacun
+            for proc in procs:
+                proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    # fusion + enrichissement (OS, EOL) côté coordinateur
+    results_to_write = []
+    for site, hosts in coord.results.items():
+        for ip, entry in hosts.items():
+            results_to_write.append(audit.build_host_record(ip, sorted(entry["ports"]), entry["hostname"]))
+
+    audit.export_results(audit.report_path("Audit distribue"), results_to_write, ports)
+
+def scan_and_resolve(ip_str, ports):
+    """scan + DNS inverse dans le même thread du pool (DNS résolu sur site)"""
+    ip_str, is_alive, open_ports = audit.scan_single_host(ip_str, ports)
+    hostname = audit.resolve_hostname(ip_str) if is_alive else None
+    return ip_str, is_alive, open_ports, hostname
+
+def heartbeat(stream, lock, interval, stopped):
+    """signe de vie régulier, indépendant de la vitesse du scan"""
+    while not stopped.wait(interval):
+        try:
+            send_msg(stream, {"type": "ping"}, lock)
+        except (OSError, ValueError):
+            return
+
+@metrics.timed("distributed.scan_unit")
+def scan_unit(unit, stream, threads):
+    """scanne une unité et renvoie les machines vivantes par lots"""
+    ranges = array('L', unit["ranges"])
+    batch = []
+
+    # le thread de heartbeat écrit sur le même flux -> verrou
+    lock = threading.Lock()
+    stopped = threading.Event()
+    interval = unit.get("heartbeat", HEARTBEAT_INTERVAL)
+    pinger = threading.Thread(target=heartbeat, args=(stream, lock, interval, stopped), daemon=True)
+    pinger.start()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            results = stream_map(executor, scan_and_resolve, iter_targets(ranges), threads * 4, unit["ports"])
+
+            for ip_str, is_alive, open_ports, hostname in results:
+                if is_alive:
+                    batch.append([ip_str, open_ports, hostname])
+                if len(batch) >= RESULT_BATCH:
+                    send_msg(stream, {"type": "result", "id": unit["id"], "hosts": batch}, lock)
+                    batch = []
+    finally:
+        stopped.set()
+        pinger.join()
+
+    send_msg(stream, {"type": "result", "id": unit["id"], "hosts": batch})
+    send_msg(stream, {"type": "done", "id": unit["id"]})
+
+def connect_coordinator(host, port, retry):
+    """le coordinateur peut démarrer après le worker (ou redémarrer)"""
+    for attempt in range(retry):
+        try:
+            return socket.create_connection((host, port), timeout=5)
+        except OSError:
+            time.sleep(1)
+    return None
+
+def run_worker(host, port=DEFAULT_PORT, name=None, sites=(), token="", threads=audit.MAX_WORKERS, retry=30):
+    """se connecte au coordinateur et traite les unités jusqu'au message stop"""
+    name = name or socket.gethostname()
+    connected = False
+
+    while True:
+        sock = connect_coordinator(host, port, retry)
+        if sock is None:
+            if connected:
+                # perdu puis plus de coordinateur : audit terminé ou arrêté
+                print(f"[INFO] Coordinateur {host}:{port} arrêté, fin du worker {name}.")
+                return True
+            print(f"[ERREUR] Coordinateur injoignable : {host}:{port}")
+            return False
+        connected = True
+
+        sock.settimeout(None)
+        stream = sock.makefile('rwb')
+        try:
+            send_msg(stream, {"type": "hello", "name": name, "sites": list(sites), "token": token})
+            while True:
+                msg = recv_msg(stream)
+                if msg is None:
+                    raise ConnectionError("connexion fermée par le coordinateur")
+                if msg.get("type") == "stop":
+                    return True
+                if msg.get("type") == "error":
+                    print(f"[ERREUR] Refus du coordinateur : {msg.get('message')}")
+                    return False
+                if msg.get("type") == "unit":
+                    scan_unit(msg, stream, threads)
+        except (OSError, ValueError) as e:
+            # connexion perdue (ex: lease expiré) -> l'unité est remise en file, on se reconnecte
+            print(f"[!] Worker {name} : {e}, reconnexion...")
+            metrics.incr("distributed.reconnects")
+        finally:
+            try:
+                stream.close()
+            except OSError:
+                # données en tampon vers une connexion déjà coupée
+                pass
+            sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit distribué (coordinateur / worker)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("coordinator", help="répartir l'audit des scan_profiles")
+    p.add_argument("--profile", type=int, action="append", help="n° de profil (défaut: tous)")
+    p.add_argument("--local-workers", type=int, default=0, help="workers à lancer sur cette machine")
+    p.add_argument("--port", type=int)
+
+    p = sub.add_parser("worker", help="traiter les unités d'un coordinateur")
+    p.add_argument("--coordinator", required=True, help="hôte:port")
+    p.add_argument("--name")
+    p.add_argument("--site", action="append", default=[], help="network_name des profils à traiter en priorité")
+    p.add_argument("--token", default="")
+    p.add_argument("--threads", type=int, default=audit.MAX_WORKERS)
+
+    args = parser.parse_args()
+    config.setup_metrics()
+
+    if args.command == "worker":
+        host, _, port = args.coordinator.partition(":")
+        with metrics.run("audit_worker"):
+            ok = run_worker(host, int(port or DEFAULT_PORT), args.name, args.site, args.token, args.threads)
+        sys.exit(0 if ok else 1)
+
+    audit_config = config.get_audit_config()
+    if not audit_config:
+        sys.exit(1)
+
+    profiles = audit_config.scan_profiles
+    if args.profile:
+        profiles = [profiles[i - 1] for i in args.profile]
+
+    with metrics.run("audit_distribue"):
+        run_coordinator(profiles, audit_config.ports_to_scan, audit_config.distributed,
+                        args.local_workers, args.port)
+
+if __name__ == "__main__":
+    main()
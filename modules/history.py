@@ -0,0 +1,463 @@
+import os
+import sys
+import csv
+import json
+import glob
+import sqlite3
+import argparse
+import ipaddress
+from datetime import datetime, date, timedelta
+from .utils import *
+from . import config
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+AUDIT_LOGS_DIR = os.path.join(os.path.dirname(BASE_DIR), "logs")
+DIAG_LOGS_DIR = os.path.join(BASE_DIR, "logs")
+DB_FILE = os.path.join(AUDIT_LOGS_DIR, "history.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT,
+    scan_date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    scan_id INTEGER NOT NULL,
+    ip TEXT NOT NULL,
+    ip_int INTEGER NOT NULL,
+    hostname TEXT,
+    os TEXT,
+    eol_status TEXT,
+    eol_date TEXT
+);
+CREATE TABLE IF NOT EXISTS ports (
+    scan_id INTEGER NOT NULL,
+    ip_int INTEGER NOT NULL,
+    port INTEGER NOT NULL,
+    is_open INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scans_path ON scans(path);
+CREATE INDEX IF NOT EXISTS idx_scans_date ON scans(scan_date);
+CREATE INDEX IF NOT EXISTS idx_hosts_ip ON hosts(ip_int, scan_id);
+CREATE INDEX IF NOT EXISTS idx_hosts_os ON hosts(os);
+CREATE INDEX IF NOT EXISTS idx_hosts_eol ON hosts(eol_date);
+CREATE INDEX IF NOT EXISTS idx_ports_ip ON ports(ip_int, port, scan_id);
+CREATE INDEX IF NOT EXISTS idx_ports_port ON ports(port, is_open);
+"""
+
+def connect(db_file=DB_FILE):
+    """ouvre (ou crée) la base d'historique"""
+    folder = os.path.dirname(db_file)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    conn = sqlite3.connect(db_file)
+    conn.executescript(SCHEMA)
+    return conn
+
+def ip_to_int(ip_str):
+    return int(ipaddress.IPv4Address(ip_str))
+
+def parse_ports(value):
+    """'[22, 80]' -> [22, 80]"""
+    ports = []
+    for part in str(value).strip("[] ").split(","):
+        part = part.strip()
+        if part.isdigit():
+            ports.append(int(part))
+    return ports
+
+def parse_date(value):
+    """garde uniquement les dates YYYY-MM-DD, sinon None"""
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+def parse_audit_filename(path):
+    """AUDIT_<reseau>_<YYYYmmdd>_<HHMMSS>.csv -> (reseau, date ISO)"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    parts = stem.split("_")
+    try:
+        scan_date = datetime.strptime(parts[-2] + parts[-1], "%Y%m%d%H%M%S")
+    except (ValueError, IndexError):
+        scan_date = datetime.fromtimestamp(os.path.getmtime(path))
+    name = "_".join(parts[1:-2]) or stem
+    return name, scan_date.isoformat()
+
+def read_audit_csv(path):
+    """retourne (nom réseau, date, liste hosts, liste ports) d'un AUDIT_*.csv"""
+    name, scan_date = parse_audit_filename(path)
+    hosts = []
+    ports = []
+
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f, delimiter=';')
+        for row in reader:
+            ip = row.get('IP')
+            try:
+                ip_int = ip_to_int(ip)
+            except ValueError:
+                continue
+
+            hosts.append((
+                ip, ip_int,
+                row.get('Nom (DNS)'),
+                row.get('OS Détecté'),
+                row.get('Statut Support (EOL)'),
+                parse_date(row.get('Date Fin Support'))
+            ))
+            open_ports = parse_ports(row.get('Ports Ouverts', ''))
+            # anciens rapports sans 'Ports Testés' : seuls les ports ouverts sont connus
+            tested = parse_ports(row.get('Ports Testés') or '') or open_ports
+            for port in dict.fromkeys(tested + open_ports):
+                ports.append((ip_int, port, 1 if port in open_ports else 0))
+
+    return name, scan_date, hosts, ports
+
+def read_diag_json(path):
+    """retourne (machine, date, liste hosts, liste ports) d'un diag_*.json"""
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+
+    name = report.get("machine")
+    scan_date = report.get("scan_date") or datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+    data = report.get("scan_result", {})
+    ip = report.get("ip")
+
+    # anciens rapports sans IP -> retrouvée via l'inventaire si possible
+    if not ip:
+        inventory = config.get_diagnostic_config()
+        machine = inventory.by_name.get(name) if inventory else None
+        if not machine:
+            return name, scan_date, [], []
+        ip = machine.ip
+
+    ip_int = ip_to_int(ip)
+    hosts = [(ip, ip_int, name, data.get("OS"), None, None)]
+    ports = []
+    for key, value in data.items():
+        # ex: "Port 3389": "Ouvert"
+        if key.startswith("Port ") and key[5:].isdigit():
+            ports.append((ip_int, int(key[5:]), 1 if value == "Ouvert" else 0))
+
+    return name, scan_date, hosts, ports
+
+def list_report_files():
+    files = []
+    for path in glob.glob(os.path.join(AUDIT_LOGS_DIR, "AUDIT_*.csv")):
+        files.append(("audit", path))
+    for path in glob.glob(os.path.join(DIAG_LOGS_DIR, "diag_*.json")):
+        files.append(("diag", path))
+    return files
+
+def delete_report(conn, path):
+    """supprime les scans (et leurs hosts/ports) issus d'un fichier"""
+    old_ids = [row[0] for row in conn.execute("SELECT id FROM scans WHERE path = ?", (path,))]
+    for scan_id in old_ids:
+        conn.execute("DELETE FROM hosts WHERE scan_id = ?", (scan_id,))
+        conn.execute("DELETE FROM ports WHERE scan_id = ?", (scan_id,))
+        conn.execute("DELETE FROM scans WHERE id = ?", (scan_id,))
+
+def ingest(conn, verbose=False):
+    """indexe seulement les rapports nouveaux ou modifiés depuis le dernier passage"""
+    known = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT path, mtime, size FROM files")}
+    added = 0
+    report_files = list_report_files()
+
+    # rapports supprimés du disque -> retirés de l'historique
+    present = {path for kind, path in report_files}
+    removed = [path for path in known if path not in present]
+    if removed:
+        with conn:
+            for path in removed:
+                delete_report(conn, path)
+                conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    for kind, path in report_files:
+        try:
+            # rapport supprimé entre le glob et la lecture -> ignoré
+            stat = os.stat(path)
+            if known.get(path) == (stat.st_mtime, stat.st_size):
+                continue
+
+            if kind == "audit":
+                name, scan_date, hosts, ports = read_audit_csv(path)
+            else:
+                name, scan_date, hosts, ports = read_diag_json(path)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError, csv.Error) as e:
+            print(f"[ERREUR] Lecture rapport {path} : {e}")
+            continue
+
+        with conn:
+            # fichier modifié -> on remplace l'ancienne version
+            delete_report(conn, path)
+
+            cur = conn.execute(
+                "INSERT INTO scans (path, kind, name, scan_date) VALUES (?, ?, ?, ?)",
+                (path, kind, name, scan_date)
+            )
+            scan_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO hosts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(scan_id,) + h for h in hosts]
+            )
+            conn.executemany(
+                "INSERT INTO ports VALUES (?, ?, ?, ?)",
+                [(scan_id,) + p for p in ports]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (path, stat.st_mtime, stat.st_size)
+            )
+        added += 1
+
+    if verbose:
+        print(f"[INFO] {added} rapport(s) indexé(s), {len(removed)} retiré(s).")
+    return added
+
+def port_timeline(conn, ip, port):
+    """
+    historique d'un port sur une IP
+    return : liste (date, kind, ouvert) + ouvertures [(date, confirmée)]
+    une ouverture n'est confirmée que si un scan antérieur a testé le port fermé
+    """
+    ip_int = ip_to_int(ip)
+    rows = conn.execute("""
+        SELECT s.scan_date, s.kind, p.is_open
+        FROM hosts h
+        JOIN scans s ON s.id = h.scan_id
+        LEFT JOIN ports p ON p.scan_id = h.scan_id AND p.ip_int = h.ip_int AND p.port = ?
+        WHERE h.ip_int = ?
+        ORDER BY s.scan_date
+    """, (port, ip_int)).fetchall()
+
+    timeline = []
+    openings = []
+    previous = None
+    for scan_date, kind, is_open in rows:
+        if is_open is None:
+            # port absent du rapport = non testé (diag, audit sans ce port, ancien CSV) -> inconnu
+            continue
+
+        if is_open and not previous:
+            openings.append((scan_date, previous is not None))
+
+        timeline.append((scan_date, kind, bool(is_open)))
+        previous = is_open
+
+    return timeline, openings
+
+def host_history(conn, ip):
+    """tous les passages d'une IP (audit + diag)"""
+    return conn.execute("""
+        SELECT s.scan_date, s.kind, s.name, h.hostname, h.os, h.eol_status, h.eol_date,
+               (SELECT GROUP_CONCAT(p.port) FROM ports p
+                WHERE p.scan_id = h.scan_id AND p.ip_int = h.ip_int AND p.is_open = 1)
+        FROM hosts h
+        JOIN scans s ON s.id = h.scan_id
+        WHERE h.ip_int = ?
+        ORDER BY s.scan_date
+    """, (ip_to_int(ip),)).fetchall()
+
+def hosts_eol_between(conn, start, end):
+    """machines dont la fin de support tombe entre start et end (YYYY-MM-DD)"""
+    return conn.execute("""
+        SELECT h.ip, h.hostname, h.os, h.eol_date, MAX(s.scan_date)
+        FROM hosts h
+        JOIN scans s ON s.id = h.scan_id
+        WHERE h.eol_date BETWEEN ? AND ?
+        GROUP BY h.ip_int
+        ORDER BY h.eol_date, h.ip_int
+    """, (start, end)).fetchall()
+
+def hosts_by_os(conn, os_pattern):
+    """dernière observation des machines dont l'OS contient os_pattern"""
+    return conn.execute("""
+        SELECT h.ip, h.hostname, h.os, h.eol_status, MAX(s.scan_date)
+        FROM hosts h
+        JOIN scans s ON s.id = h.scan_id
+        WHERE h.os LIKE ?
+        GROUP BY h.ip_int
+        ORDER BY h.ip_int
+    """, (f"%{os_pattern}%",)).fetchall()
+
+def day_after(value):
+    """'2026-02-01' -> '2026-02-02' (borne exclusive : scan_date contient l'heure)"""
+    day = datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+    return (day + timedelta(days=1)).isoformat()
+
+def hosts_with_port(conn, port, start=None, end=None):
+    """IPs vues avec le port ouvert sur une période (bornes YYYY-MM-DD incluses)"""
+    return conn.execute("""
+        SELECT h.ip, MIN(s.scan_date), MAX(s.scan_date), COUNT(*)
+        FROM ports p
+        JOIN scans s ON s.id = p.scan_id
+        JOIN hosts h ON h.scan_id = p.scan_id AND h.ip_int = p.ip_int
+        WHERE p.port = ? AND p.is_open = 1
+          AND s.scan_date >= ? AND s.scan_date < ?
+        GROUP BY p.ip_int
+        ORDER BY p.ip_int
+    """, (port, start or "0000", day_after(end) if end else "9999")).fetchall()
+
+def quarter_bounds(value=None):
+    """'2026Q3' (ou trimestre courant) -> ('2026-07-01', '2026-09-30')"""
+    if value:
+        year, _, quarter = value.upper().partition("Q")
+        year, quarter = int(year), int(quarter)
+        if not 1 <= quarter <= 4:
+            raise ValueError(f"trimestre invalide : {value} (Q1 à Q4)")
+    else:
+        today = date.today()
+        year, quarter = today.year, (today.month - 1) // 3 + 1
+
+    start_month = 3 * (quarter - 1) + 1
+    end_day = {3: 31, 6: 30, 9: 30, 12: 31}[start_month + 2]
+    return f"{year}-{start_month:02d}-01", f"{year}-{start_month + 2:02d}-{end_day}"
+
+def print_port_timeline(conn, ip, port):
+    timeline, openings = port_timeline(conn, ip, port)
+    if not timeline:
+        print(f"[INFO] Aucune observation de {ip} dans l'historique.")
+        return
+
+    for scan_date, kind, is_open in timeline:
+        print(f"    {scan_date}  [{kind:<5}]  TCP/{port} : {'Ouvert' if is_open else 'Fermé'}")
+    if openings:
+        for scan_date, confirmed in openings:
+            if confirmed:
+                print(f"\n[+] Port {port} ouvert sur {ip} le {scan_date} (fermé au scan précédent)")
+            else:
+                print(f"\n[+] Port {port} vu ouvert sur {ip} le {scan_date} "
+                      f"(aucun scan antérieur ne l'a testé : date d'ouverture réelle inconnue)")
+    else:
+        print(f"\n[-] Port {port} jamais vu ouvert sur {ip}.")
+
+def print_host_history(conn, ip):
+    rows = host_history(conn, ip)
+    if not rows:
+        print(f"[INFO] Aucune observation de {ip} dans l'historique.")
+    for scan_date, kind, name, hostname, os_name, eol_status, eol_date, ports in rows:
+        print(f"    {scan_date}  [{kind:<5}] {name} | {hostname} | {os_name} | {eol_status or '-'} (Fin: {eol_date or 'N/A'}) | Ports: {ports or '-'}")
+
+def print_eol(conn, start, end):
+    rows = hosts_eol_between(conn, start, end)
+    print(f"[*] Fin de support entre {start} et {end} : {len(rows)} machine(s)")
+    for ip, hostname, os_name, eol_date, last_seen in rows:
+        print(f"    [+] {ip:<15} ({hostname}) | {os_name} | Fin: {eol_date} | Vu le {last_seen}")
+
+def print_os(conn, os_pattern):
+    rows = hosts_by_os(conn, os_pattern)
+    print(f"[*] OS contenant '{os_pattern}' : {len(rows)} machine(s)")
+    for ip, hostname, os_name, eol_status, last_seen in rows:
+        print(f"    [+] {ip:<15} ({hostname}) | {os_name} | {eol_status} | Vu le {last_seen}")
+
+def print_port(conn, port, start=None, end=None):
+    rows = hosts_with_port(conn, port, start, end)
+    print(f"[*] Port TCP/{port} ouvert : {len(rows)} machine(s)")
+    for ip, first_seen, last_seen, count in rows:
+        print(f"    [+] {ip:<15} | du {first_seen} au {last_seen} ({count} scan(s))")
+
+def history_menu():
+    conn = connect()
+    ingest(conn, verbose=True)
+
+    while True:
+        print("\n--- MODULE HISTORIQUE DES RAPPORTS ---")
+        print("1. Historique d'un port sur une IP")
+        print("2. Historique complet d'une IP")
+        print("3. Machines en fin de support (trimestre)")
+        print("4. Machines par OS")
+        print("5. Machines avec un port ouvert")
+        print("r. Ré-indexer les rapports")
+        print("q. Retour")
+
+        choice = input("Votre choix : ")
+
+        try:
+            if choice == '1':
+                ip = input("IP : ").strip()
+                port = int(input("Port : "))
+                print_port_timeline(conn, ip, port)
+            elif choice == '2':
+                print_host_history(conn, input("IP : ").strip())
+            elif choice == '3':
+                quarter = input("Trimestre (ex: 2026Q3, vide = courant) : ").strip()
+                print_eol(conn, *quarter_bounds(quarter or None))
+            elif choice == '4':
+                print_os(conn, input("OS (ex: Windows Server 2016) : ").strip())
+            elif choice == '5':
+                print_port(conn, int(input("Port : ")))
+            elif choice == 'r':
+                ingest(conn, verbose=True)
+                continue
+            elif choice == 'q':
+                break
+            else:
+                print("Choix invalide.")
+                continue
+        except ValueError as e:
+            print(f"[ERREUR] Saisie invalide : {e}")
+
+        wait_for_user()
+
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Requêtes sur l'historique des audits et diagnostics")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("ingest", help="indexer les nouveaux rapports")
+
+    p = sub.add_parser("port", help="historique d'un port sur une IP (ou IPs avec ce port)")
+    p.add_argument("port", type=int)
+    p.add_argument("ip", nargs="?")
+    p.add_argument("--from", dest="start")
+    p.add_argument("--to", dest="end")
+
+    p = sub.add_parser("host", help="historique complet d'une IP")
+    p.add_argument("ip")
+
+    p = sub.add_parser("eol", help="machines en fin de support sur une période")
+    p.add_argument("--quarter", help="ex: 2026Q3 (défaut: trimestre courant)")
+    p.add_argument("--from", dest="start")
+    p.add_argument("--to", dest="end")
+
+    p = sub.add_parser("os", help="machines par OS")
+    p.add_argument("pattern")
+
+    args = parser.parse_args()
+
+    conn = connect()
+    ingest(conn, verbose=args.command == "ingest")
+
+    try:
+        if args.command == "port":
+            if args.ip:
+                print_port_timeline(conn, args.ip, args.port)
+            else:
+                print_port(conn, args.port, args.start, args.end)
+        elif args.command == "host":
+            print_host_history(conn, args.ip)
+        elif args.command == "eol":
+            start, end = quarter_bounds(args.quarter)
+            print_eol(conn, args.start or start, args.end or end)
+        elif args.command == "os":
+            print_os(conn, args.pattern)
+    except ValueError as e:
+        print(f"[ERREUR] Saisie invalide : {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import functools
+from collections import Counter
+
+# instrumentation légère : timers par étape, compteurs, octets traités
+# désactivée par défaut -> timer() renvoie un objet vide, coût ~ un appel de fonction
+#   NTL_METRICS=1              résumé affiché en fin d'exécution
+#   NTL_METRICS_FILE=chemin    + export texte au format Prometheus (node_exporter textfile),
+#                              un fichier par run : metrics.prom -> metrics_audit.prom, metrics_backup.prom...
+#   NTL_PROFILE=cprofile|sample  + profilage (cProfile du thread principal ou échantillonnage de tous les threads)
+# cProfile ne voit pas les threads des pools (scan_single_host, probes...) :
+# pour un audit ou un diagnostic, utiliser NTL_PROFILE=sample
+
+ENABLED = os.environ.get("NTL_METRICS", "") not in ("", "0")
+PROM_FILE = os.environ.get("NTL_METRICS_FILE") or None
+PROFILE_MODE = os.environ.get("NTL_PROFILE") or None
+
+SAMPLE_INTERVAL = 0.01
+PROFILE_TOP = 15
+
+_lock = threading.Lock()
+_run_name = None
+_run_start = 0.0
+_timers = {}    # étape -> [appels, total s, max s]
+_counters = Counter()
+_bytes = Counter()
+_profiler = None
+
+def configure(enabled=None, prom_file=None, profile=None):
+    """active/désactive depuis la config (les variables d'env restent prioritaires)"""
+    global ENABLED, PROM_FILE, PROFILE_MODE
+    if enabled is not None and "NTL_METRICS" not in os.environ:
+        ENABLED = bool(enabled)
+    if prom_file and not PROM_FILE:
+        PROM_FILE = prom_file
+    if profile and not PROFILE_MODE:
+        PROFILE_MODE = profile
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        with _lock:
+            stats = _timers.get(self.stage)
+            if stats is None:
+                _timers[self.stage] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+        return False
+
+def timer(stage):
+    """with metrics.timer("backup.gzip"): ..."""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(stage)
+
+def timed(stage):
+    """décorateur équivalent à timer() sur toute la fonction"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with _Timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def incr(name, value=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] += value
+
+def add_bytes(stage, value):
+    """octets traités par une étape (débit = octets / temps du timer de même nom)"""
+    if not ENABLED or not value:
+        return
+    with _lock:
+        _bytes[stage] += value
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class _Sampler(threading.Thread):
+    """profilage par échantillonnage de toutes les piles (utile pour les pools de threads)"""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                self.samples[f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def start_run(name):
+    global _run_name, _run_start, _profiler
+    if not ENABLED:
+        return
+    with _lock:
+        _run_name = name
+        _run_start = time.perf_counter()
+        _timers.clear()
+        _counters.clear()
+        _bytes.clear()
+
+    if PROFILE_MODE == "cprofile":
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    elif PROFILE_MODE == "sample":
+        _profiler = _Sampler()
+        _profiler.start()
+
+def end_run():
+    global _profiler, _run_name
+    if not ENABLED or _run_name is None:
+        return
+    duration = time.perf_counter() - _run_start
+
+    profiler, _profiler = _profiler, None
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+    elif isinstance(profiler, _Sampler):
+        profiler.stop()
+
+    print_summary(duration)
+    if PROM_FILE:
+        write_prometheus(run_file(PROM_FILE, _run_name), duration)
+
+    if isinstance(profiler, cProfile.Profile):
+        print(f"\n--- PROFIL cProfile ({PROFILE_TOP} plus coûteux) ---")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_TOP)
+    elif isinstance(profiler, _Sampler):
+        total = sum(profiler.samples.values())
+        print(f"\n--- PROFIL échantillonné ({total} échantillons) ---")
+        for location, count in profiler.samples.most_common(PROFILE_TOP):
+            print(f" {count * 100 / total:5.1f}%  {location}")
+
+    # run terminé : un second end_run() (ex: branche d'erreur) ne réaffiche rien
+    _run_name = None
+
+class run:
+    """with metrics.run("audit"): ... -> start_run() + end_run()"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        start_run(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        end_run()
+        return False
+
+def format_bytes(value):
+    for unit in ("o", "Ko", "Mo", "Go"):
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} To"
+
+def print_summary(duration):
+    with _lock:
+        timers = {stage: list(stats) for stage, stats in _timers.items()}
+        counters = dict(_counters)
+        volumes = dict(_bytes)
+
+    print("\n" + "="*70)
+    print(f" MÉTRIQUES : {_run_name} (durée totale {duration:.2f} s)")
+    print("="*70)
+
+    if timers:
+        print(f" {'ÉTAPE':<32} {'APPELS':>7} {'TOTAL (s)':>10} {'MOY (ms)':>9} {'MAX (ms)':>9}")
+        for stage, (calls, total, longest) in sorted(timers.items(), key=lambda x: -x[1][1]):
+            print(f" {stage:<32} {calls:>7} {total:>10.3f} {total * 1000 / calls:>9.1f} {longest * 1000:>9.1f}")
+
+    if volumes:
+        print("-" * 70)
+        for stage, value in sorted(volumes.items()):
+            rate = ""
+            if stage in timers and timers[stage][1] > 0:
+                rate = f" ({format_bytes(value / timers[stage][1])}/s)"
+            print(f" {stage:<32} {format_bytes(value)}{rate}")
+
+    if counters:
+        print("-" * 70)
+        for name, value in sorted(counters.items()):
+            print(f" {name:<32} {value}")
+
+    print("="*70)
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+def run_file(path, run_name):
+    """metrics.prom + 'audit' -> metrics_audit.prom (un run n'écrase pas les autres)"""
+    root, ext = os.path.splitext(path)
+    safe_name = "".join([c if c.isalnum() else "_" for c in str(run_name)])
+    return f"{root}_{safe_name}{ext}"
+
+def write_prometheus(path, duration):
+    """
+    format texte Prometheus, écrit via fichier temporaire (lecture atomique)
+    valeurs du dernier run uniquement (remises à zéro à chaque run) -> gauges, pas counters
+    """
+    run_label = _label(_run_name)
+    lines = [
+        "# TYPE ntl_run_duration_seconds gauge",
+        f'ntl_run_duration_seconds{{run="{run_label}"}} {duration:.6f}',
+        "# TYPE ntl_stage_seconds gauge",
+    ]
+    with _lock:
+        for stage, (calls, total, longest) in sorted(_timers.items()):
+            lines.append(f'ntl_stage_seconds{{run="{run_label}",stage="{_label(stage)}"}} {total:.6f}')
+        lines.append("# TYPE ntl_stage_calls gauge")
+        for stage, (calls, total, longest) in sorted(_timers.items()):
+            lines.append(f'ntl_stage_calls{{run="{run_label}",stage="{_label(stage)}"}} {calls}')
+        lines.append("# TYPE ntl_stage_max_seconds gauge")
+        for stage, (calls, total, longest) in sorted(_timers.items()):
+            lines.append(f'ntl_stage_max_seconds{{run="{run_label}",stage="{_label(stage)}"}} {longest:.6f}')
+        lines.append("# TYPE ntl_bytes gauge")
+        for stage, value in sorted(_bytes.items()):
+            lines.append(f'ntl_bytes{{run="{run_label}",stage="{_label(stage)}"}} {value}')
+        lines.append("# TYPE ntl_events gauge")
+        for name, value in sorted(_counters.items()):
+            lines.append(f'ntl_events{{run="{run_label}",name="{_label(name)}"}} {value}')
+
+    try:
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+        print(f"[FICHIER] Métriques exportées : {path}")
+    except OSError as e:
+        print(f"[ERREUR] Export métriques : {e}")
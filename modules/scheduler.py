@@ -0,0 +1,243 @@
+import sys
+import time
+import shutil
+import threading
+import subprocess
+import concurrent.futures
+from datetime import datetime, timedelta
+from . import metrics
+
+# ordonnancement des sauvegardes :
+# - politique (débit, parallélisme, priorité) choisie selon la plage horaire
+# - seaux à jetons partagés entre tous les jobs pour le dump et l'envoi SFTP
+# - priorité basse (nice/ionice, BELOW_NORMAL sous Windows) pour mysqldump
+# - plage horaire revérifiée pendant les copies et entre les jobs (un dump de nuit
+#   qui déborde sur la journée est ralenti, une file lancée à 19:59 s'élargit à 20:00)
+
+CHUNK_SIZE = 256 * 1024
+POLICY_CHECK = 30   # s entre deux vérifications de la plage horaire pendant une copie
+
+class TokenBucket:
+    """limite de débit en octets/s, partagée entre threads (rate 0 = illimité)"""
+
+    def __init__(self, rate, burst=None, on_consume=None):
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        # appelé avant chaque prise de jetons (ex: changement de plage horaire)
+        self.on_consume = on_consume
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.rate = float(rate)
+            self.burst = float(burst or max(rate, CHUNK_SIZE))
+            self.tokens = min(self.tokens, self.burst)
+
+    def consume(self, amount):
+        """bloque jusqu'à ce que `amount` octets soient autorisés"""
+        while amount > 0:
+            if self.on_consume:
+                self.on_consume()
+            with self.lock:
+                if self.rate <= 0:
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+
+                # gros blocs consommés par morceaux de taille <= burst
+                step = min(amount, self.burst)
+                if self.tokens >= step:
+                    self.tokens -= step
+                    amount -= step
+                    continue
+                wait = (step - self.tokens) / self.rate
+            with metrics.timer("scheduler.throttle_wait"):
+                time.sleep(wait)
+
+class ThrottledReader:
+    """enveloppe un fichier : chaque read() passe par le seau à jetons"""
+
+    def __init__(self, fileobj, bucket):
+        self.fileobj = fileobj
+        self.bucket = bucket
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if data and self.bucket:
+            self.bucket.consume(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+class Limits:
+    """
+    limites en cours pour une file de jobs
+    avec `scheduling`, la politique suit la plage horaire même au milieu d'une copie
+    """
+
+    def __init__(self, policy, scheduling=None):
+        self.lock = threading.Lock()
+        self.scheduling = scheduling
+        self.checked = time.monotonic()
+        self.upload = TokenBucket(policy.upload_kbps * 1024, on_consume=self.refresh)
+        self.dump = TokenBucket(policy.dump_kbps * 1024, on_consume=self.refresh)
+        self.priority = policy.priority
+        self.policy_name = policy.name
+        self.processes = set()
+
+    def apply(self, policy):
+        with self.lock:
+            if policy.name == self.policy_name:
+                return
+            print(f"[INFO] Passage à la politique '{policy.name}'")
+            self.upload.set_rate(policy.upload_kbps * 1024)
+            self.dump.set_rate(policy.dump_kbps * 1024)
+            self.priority = policy.priority
+            self.policy_name = policy.name
+            for process in self.processes:
+                set_process_priority(process.pid, policy.priority)
+
+    def refresh(self, force=False):
+        """ré-applique la politique de la plage courante (au plus toutes les POLICY_CHECK s)"""
+        if self.scheduling is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.checked < POLICY_CHECK:
+            return
+        self.checked = now
+        self.apply(current_policy(self.scheduling))
+
+    def register(self, process):
+        """process (mysqldump) dont la priorité suit les changements de politique"""
+        with self.lock:
+            self.processes.add(process)
+
+    def unregister(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+def _minutes(moment):
+    return moment.hour * 60 + moment.minute
+
+def _in_window(window, minute):
+    if window.start <= window.end:
+        return window.start <= minute < window.end
+    # fenêtre à cheval sur minuit (ex: 20:00 -> 06:00)
+    return minute >= window.start or minute < window.end
+
+def current_policy(scheduling, now=None):
+    minute = _minutes(now or datetime.now())
+    for window in scheduling.windows:
+        if _in_window(window, minute):
+            return window.policy
+    return scheduling.default
+
+def next_window_start(scheduling, now=None):
+    """date de la prochaine ouverture de fenêtre (None si aucune fenêtre)"""
+    now = now or datetime.now()
+    starts = []
+    for window in scheduling.windows:
+        start = now.replace(hour=window.start // 60, minute=window.start % 60, second=0, microsecond=0)
+        if start <= now:
+            start += timedelta(days=1)
+        starts.append(start)
+    return min(starts) if starts else None
+
+def wait_for_window(scheduling):
+    """bloque jusqu'à la prochaine fenêtre si on est hors fenêtre"""
+    if not scheduling.windows or current_policy(scheduling) is not scheduling.default:
+        return
+    start = next_window_start(scheduling)
+    print(f"[INFO] Hors fenêtre de sauvegarde, attente jusqu'à {start.strftime('%H:%M')}...")
+    while datetime.now() < start:
+        time.sleep(min(60, max(1, (start - datetime.now()).total_seconds())))
+
+def process_options(priority):
+    """(préfixe commande, kwargs Popen) pour lancer un process avec la priorité voulue"""
+    if priority not in ("low", "idle"):
+        return [], {}
+
+    if sys.platform == "win32":
+        flag = subprocess.IDLE_PRIORITY_CLASS if priority == "idle" else subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        return [], {"creationflags": flag}
+
+    # préfixes plutôt que preexec_fn (non sûr avec plusieurs threads)
+    prefix = []
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", "19" if priority == "idle" else "10"]
+    if shutil.which("ionice"):
+        # idle : E/S seulement quand le disque est libre ; low : best-effort prio minimale
+        prefix += ["ionice", "-c3"] if priority == "idle" else ["ionice", "-c2", "-n7"]
+    return prefix, {}
+
+def set_process_priority(pid, priority):
+    """
+    abaisse la priorité d'un process déjà lancé (POSIX : renice/ionice)
+    remonter la priorité demande root -> échec silencieux, sans effet sous Windows
+    """
+    if sys.platform == "win32" or priority not in ("low", "idle"):
+        return
+    prefix, _ = process_options(priority)
+    commands = []
+    if "nice" in prefix:
+        commands.append(["renice", "-n", "19" if priority == "idle" else "10", "-p", str(pid)])
+    if "ionice" in prefix:
+        commands.append(["ionice"] + (["-c3"] if priority == "idle" else ["-c2", "-n7"]) + ["-p", str(pid)])
+    for command in commands:
+        try:
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            pass
+
+def all_policies(scheduling):
+    return [scheduling.default] + [window.policy for window in scheduling.windows]
+
+def may_throttle(scheduling):
+    """vrai si une des politiques ralentit le dump (un dump peut changer de plage en cours)"""
+    return any(p.dump_kbps > 0 or p.priority != "normal" for p in all_policies(scheduling))
+
+def run_queue(jobs, scheduling, limits=None):
+    """
+    exécute les jobs [(nom, fonction(limits))], parallélisme de la politique courante
+    revérifié à chaque fin de job et toutes les POLICY_CHECK s
+    return : liste (nom, succès)
+    """
+    policy = current_policy(scheduling)
+    limits = limits or Limits(policy, scheduling)
+    print(f"\n[*] File de sauvegarde : {len(jobs)} job(s), politique '{policy.name}' "
+          f"(parallélisme {policy.parallelism}, envoi {policy.upload_kbps or '∞'} Ko/s, "
+          f"dump {policy.dump_kbps or '∞'} Ko/s, priorité {policy.priority})")
+
+    def run_job(job):
+        name, func = job
+        limits.refresh(force=True)
+        try:
+            return name, bool(func(limits))
+        except Exception as e:
+            print(f"[ERREUR] Job {name} : {e}")
+            return name, False
+
+    results = [None] * len(jobs)
+    queue = list(enumerate(jobs))
+    running = {}
+    max_workers = max(p.parallelism for p in all_policies(scheduling))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while queue or running:
+            parallelism = current_policy(scheduling).parallelism
+            while queue and len(running) < parallelism:
+                index, job = queue.pop(0)
+                running[executor.submit(run_job, job)] = index
+
+            done, _ = concurrent.futures.wait(running, timeout=POLICY_CHECK,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    print("\n--- BILAN FILE DE SAUVEGARDE ---")
+    for name, ok in results:
+        print(f"    [{'OK' if ok else 'ÉCHEC'}] {name}")
+    return results
@@ -0,0 +1,127 @@
+import socket
+import struct
+import ipaddress
+import concurrent.futures
+from array import array
+
+# une cible = suite de plages [début, fin] d'IPs en entiers, stockées à plat
+# dans un array('L') : [d0, f0, d1, f1, ...] -> mémoire constante quelle que
+# soit la taille du réseau (/16 = 2 entiers au lieu de 65k objets IPv4Address)
+
+def ip_to_int(ip_str):
+    """adresse complète uniquement (pas de '10.1') ; ValueError si invalide"""
+    return int(ipaddress.IPv4Address(ip_str))
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack("!I", value))
+
+def host_range(cidr):
+    """plage des IPs utilisables d'un CIDR (même règle que network.hosts())"""
+    network = ipaddress.IPv4Network(cidr, strict=False)
+    start = int(network.network_address)
+    end = int(network.broadcast_address)
+    if network.prefixlen < 31:
+        start += 1
+        end -= 1
+    return start, end
+
+def exclusion_range(entry):
+    """'192.168.10.0/28', '192.168.10.5' ou '192.168.10.5-192.168.10.9' -> plage complète"""
+    entry = str(entry).strip()
+    if "-" in entry:
+        first, last = entry.split("-", 1)
+        start, end = ip_to_int(first.strip()), ip_to_int(last.strip())
+        if start > end:
+            raise ValueError(f"plage inversée : {entry}")
+        return start, end
+    network = ipaddress.IPv4Network(entry, strict=False)
+    return int(network.network_address), int(network.broadcast_address)
+
+def merge_ranges(ranges):
+    """trie + fusionne les plages qui se chevauchent ou se touchent"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+def subtract_ranges(ranges, excluded):
+    """retire les plages exclues (les deux listes doivent être fusionnées)"""
+    result = []
+    i = 0
+    for start, end in ranges:
+        while i < len(excluded) and excluded[i][1] < start:
+            i += 1
+        j = i
+        while j < len(excluded) and excluded[j][0] <= end:
+            ex_start, ex_end = excluded[j]
+            if ex_start > start:
+                result.append([start, ex_start - 1])
+            start = max(start, ex_end + 1)
+            j += 1
+        if start <= end:
+            result.append([start, end])
+    return result
+
+def build_targets(cidrs, exclude=()):
+    """
+    construit l'ensemble des cibles à partir de plusieurs CIDR
+    -> dédoublonné (profils qui se chevauchent) et sans les exclusions
+    """
+    ranges = merge_ranges([host_range(cidr) for cidr in cidrs])
+    if exclude:
+        ranges = subtract_ranges(ranges, merge_ranges([exclusion_range(e) for e in exclude]))
+
+    targets = array('L')
+    for start, end in ranges:
+        targets.extend((start, end))
+    return targets
+
+def count_targets(targets):
+    return sum(targets[i + 1] - targets[i] + 1 for i in range(0, len(targets), 2))
+
+def iter_targets(targets):
+    """génère les IPs (str) une par une, sans matérialiser la liste"""
+    for i in range(0, len(targets), 2):
+        for value in range(targets[i], targets[i + 1] + 1):
+            yield int_to_ip(value)
+
+def chunk_targets(targets, size):
+    """découpe en sous-ensembles d'au plus `size` IPs (utile pour répartir le travail)"""
+    if size <= 0:
+        raise ValueError(f"taille de découpage invalide : {size}")
+    chunk = array('L')
+    count = 0
+    for i in range(0, len(targets), 2):
+        start, end = targets[i], targets[i + 1]
+        while start <= end:
+            take = min(end - start + 1, size - count)
+            chunk.extend((start, start + take - 1))
+            count += take
+            start += take
+            if count == size:
+                yield chunk
+                chunk = array('L')
+                count = 0
+    if count:
+        yield chunk
+
+def stream_map(executor, func, items, max_in_flight, *args):
+    """
+    équivalent de executor.map() mais en flux :
+    au plus `max_in_flight` tâches en attente, résultats rendus dès qu'ils arrivent
+    """
+    pending = set()
+
+    for item in items:
+        pending.add(executor.submit(func, item, *args))
+        if len(pending) >= max_in_flight:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    for future in concurrent.futures.as_completed(pending):
+        yield future.result()
@@ -1,5 +1,7 @@
 import os
 import socket
+import concurrent.futures
+from . import metrics
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -7,9 +9,31 @@ def clear_screen():
 def wait_for_user():
     input("\nAppuyez sur Entrée pour continuer...")
 
-def detect_os_type(ip):
+def probe_port(ip, port, timeout=1):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        return sock.connect_ex((ip, port)) == 0
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+def probe_ports(ip, ports, timeout=1):
+    """teste tous les ports en même temps -> {port: ouvert}, durée max = 1 timeout"""
+    ports = list(ports)
+    if not ports:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        results = executor.map(lambda port: probe_port(ip, port, timeout), ports)
+        return dict(zip(ports, results))
+
+@metrics.timed("diagnostic.detect_os_type")
+def detect_os_type(ip, probes=None):
     """
     tente de deviner l'OS en fonction des ports ouverts
+    probes : dict optionnel {port: ouvert} ; les ports déjà présents ne sont pas
+             retestés, les autres sont testés puis ajoutés
     return : 'linux_ssh', 'windows_remote', 'unknown'
     """
     # liste ports témoins
@@ -17,23 +41,19 @@ def detect_os_type(ip):
     PORT_WIN_SMB = 445
     PORT_WIN_RDP = 3389
     
-    # test SSH (Linux ?)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(1) 
-    result = sock.connect_ex((ip, PORT_SSH))
-    sock.close()
+    # SSH, SMB et RDP testés en parallèle (sauf s'ils l'ont déjà été)
+    results = dict(probes or {})
+    missing = [p for p in (PORT_SSH, PORT_WIN_SMB, PORT_WIN_RDP) if p not in results]
+    results.update(probe_ports(ip, missing))
+    if probes is not None:
+        probes.update(results)
     
-    if result == 0:
+    # test SSH (Linux ?)
+    if results[PORT_SSH]:
         return "linux_ssh"
         
     # test win (SMB ou RDP)
-    for port in [PORT_WIN_SMB, PORT_WIN_RDP]:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(1)
-        result = sock.connect_ex((ip, port))
-        sock.close()
-        
-        if result == 0:
-            return "windows_remote"
+    if results[PORT_WIN_SMB] or results[PORT_WIN_RDP]:
+        return "windows_remote"
 
-    return "unknown"
\ No newline at end of file
+    return "unknown"